@@ -0,0 +1,618 @@
+
+import sys
+import time
+import queue
+import struct
+import wave
+import threading
+import itertools
+import collections
+import numpy as np
+from multiprocessing import shared_memory
+import sounddevice as sd
+
+import utility
+
+
+class MicrophoneSource():
+    """
+    Blocks of raw int16 PCM captured from a PortAudio input device.
+
+    Used as a context manager: the stream is open inside the 'with' block and
+    read() returns (captured_at, data) tuples, where captured_at is the
+    time.monotonic() of the callback that delivered the block.
+    """
+
+    # blocks lost by all sources of the process
+    overflows_total = 0
+
+    def __init__(self, dev_index, sample_rate, channels, blocksize, maxsize=50):
+
+        self.dev_index = dev_index
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+
+        self.q = queue.Queue(maxsize=maxsize)
+        self.stream = None
+        self.overflows = 0
+
+
+    def __enter__(self):
+
+        self.stream = sd.RawInputStream(
+            device=self.dev_index,
+            samplerate=self.sample_rate,
+            blocksize=self.blocksize,
+            dtype='int16',
+            channels=self.channels,
+            callback=self.__audio_callback)
+
+        self.stream.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+    def read(self, timeout=None):
+
+        try:
+            return self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+    def pending(self):
+
+        return self.q.qsize()
+
+
+    def overruns(self):
+
+        return self.overflows
+
+
+    def __audio_callback(self, indata, frames, time_info, status):
+
+        if status:
+            print(f"[STATUS] {status}", file=sys.stderr)
+            if status.input_overflow:
+                self.overflows += 1
+                MicrophoneSource.overflows_total += 1
+
+        try:
+            self.q.put_nowait((time.monotonic(), bytes(indata)))
+        except queue.Full:
+            self.overflows += 1
+            MicrophoneSource.overflows_total += 1
+            print("[WARN] Audio queue full — dropping frame")
+
+
+class SharedAudioRing():
+    """
+    Single-producer, single-consumer ring of audio blocks in shared memory.
+
+    The producer (the API process, from the PortAudio callback) writes
+    records of [length, captured_at, payload]. The consumer (an engine worker
+    process) reads them back in order. Positions are ever-increasing byte
+    counters kept in the header; a semaphore counts the records available so
+    the consumer can block without polling. When the consumer falls behind,
+    new blocks are dropped instead of overwriting unread ones.
+    """
+
+    HEADER = struct.Struct("=QQQ")  # write position, read position, dropped blocks
+    RECORD = struct.Struct("=Id")  # payload length, captured_at
+    WRAP = 0xFFFFFFFF
+
+    def __init__(self, available, name=None, size=4*1024*1024):
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.name = self.shm.name
+        self.size = self.shm.size - self.HEADER.size
+        self.available = available
+
+        if self.owner:
+            self.reset()
+
+
+    def reset(self):
+
+        self.HEADER.pack_into(self.shm.buf, 0, 0, 0, 0)
+
+        while self.available.acquire(False):
+            pass
+
+
+    def write(self, data, captured_at):
+
+        data = memoryview(data).cast("B")
+        write_pos, read_pos, dropped = self.HEADER.unpack_from(self.shm.buf, 0)
+
+        needed = self.RECORD.size + len(data)
+        offset = write_pos % self.size
+        skip = self.size - offset if self.size - offset < needed else 0
+
+        if needed > self.size or (write_pos - read_pos) + skip + needed > self.size:
+            struct.pack_into("=Q", self.shm.buf, 16, dropped + 1)
+            return False
+
+        if skip:
+            if skip >= 4:
+                struct.pack_into("=I", self.shm.buf, self.HEADER.size + offset, self.WRAP)
+            write_pos += skip
+            offset = 0
+
+        base = self.HEADER.size + offset
+        self.RECORD.pack_into(self.shm.buf, base, len(data), captured_at)
+        self.shm.buf[base + self.RECORD.size:base + needed] = data
+
+        # publish the record only after the payload is in place
+        struct.pack_into("=Q", self.shm.buf, 0, write_pos + needed)
+        self.available.release()
+
+        return True
+
+
+    def read(self, timeout=None):
+
+        if not self.available.acquire(timeout=timeout):
+            return None
+
+        write_pos, read_pos, _ = self.HEADER.unpack_from(self.shm.buf, 0)
+
+        while read_pos < write_pos:
+
+            offset = read_pos % self.size
+            remaining = self.size - offset
+
+            if remaining < self.RECORD.size or \
+               struct.unpack_from("=I", self.shm.buf, self.HEADER.size + offset)[0] == self.WRAP:
+                read_pos += remaining
+                continue
+
+            base = self.HEADER.size + offset
+            length, captured_at = self.RECORD.unpack_from(self.shm.buf, base)
+            data = bytes(self.shm.buf[base + self.RECORD.size:base + self.RECORD.size + length])
+
+            struct.pack_into("=Q", self.shm.buf, 8, read_pos + self.RECORD.size + length)
+            return captured_at, data
+
+        return None
+
+
+    def pending_bytes(self):
+
+        write_pos, read_pos, _ = self.HEADER.unpack_from(self.shm.buf, 0)
+        return write_pos - read_pos
+
+
+    def dropped(self):
+
+        return self.HEADER.unpack_from(self.shm.buf, 0)[2]
+
+
+    def close(self):
+
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemorySource():
+    """
+    Audio source of an engine worker process. Opening it asks the API
+    process to start capturing into the shared ring with the requested
+    stream parameters.
+    """
+
+    def __init__(self, ring, open_stream, close_stream, sample_rate, channels, blocksize):
+
+        self.ring = ring
+        self.open_stream = open_stream
+        self.close_stream = close_stream
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+
+
+    def __enter__(self):
+
+        status, output = self.open_stream(self.sample_rate, self.channels, self.blocksize)
+        if not status:
+            raise RuntimeError(f"Cannot open audio stream: {output}")
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close_stream()
+
+
+    def read(self, timeout=None):
+
+        return self.ring.read(timeout)
+
+
+    def pending(self):
+
+        block_bytes = self.ring.RECORD.size + self.blocksize * self.channels * 2
+        return self.ring.pending_bytes() // block_bytes
+
+
+    def overruns(self):
+
+        return self.ring.dropped()
+
+
+class FileSource():
+    """
+    A WAV file played back in real time in place of a capture device.
+
+    Used for load tests. The file is looped and paced like a live stream,
+    converted to the requested rate and channel count. Blocks that the
+    reader does not collect in time are dropped and counted as overruns,
+    like the input overflows of a real device.
+    """
+
+    # decoded files shared by all sources: (path, sample_rate, channels) -> PCM bytes
+    cache = {}
+    cache_lock = threading.Lock()
+
+    # blocks dropped by all sources of the process
+    dropped_total = 0
+
+    def __init__(self, path, sample_rate, channels, blocksize, maxsize=50):
+
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+
+        self.q = queue.Queue(maxsize=maxsize)
+        self.overflows = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def __enter__(self):
+
+        self.audio = FileSource.load(self.path, self.sample_rate, self.channels)
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__play, daemon=True)
+        self.thread.start()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+
+    def read(self, timeout=None):
+
+        try:
+            return self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+    def pending(self):
+
+        return self.q.qsize()
+
+
+    def overruns(self):
+
+        return self.overflows
+
+
+    @classmethod
+    def load(cls, path, sample_rate, channels):
+
+        key = (path, sample_rate, channels)
+
+        with cls.cache_lock:
+
+            if key not in cls.cache:
+
+                with wave.open(path, "rb") as wf:
+                    file_rate = wf.getframerate()
+                    file_channels = wf.getnchannels()
+                    pcm = wf.readframes(wf.getnframes())
+
+                cls.cache[key] = utility.convert_pcm(pcm, file_rate, file_channels, sample_rate, channels)
+
+            return cls.cache[key]
+
+
+    def __play(self):
+
+        block_bytes = self.blocksize * self.channels * 2
+        interval = self.blocksize / self.sample_rate
+        position = 0
+        next_at = time.monotonic()
+
+        while True:
+
+            next_at += interval
+            if self.stopped.wait(max(next_at - time.monotonic(), 0)):
+                break
+
+            start = position % len(self.audio)
+            block = self.audio[start:start + block_bytes]
+            while len(block) < block_bytes:
+                block += self.audio[:block_bytes - len(block)]
+            position = start + block_bytes
+
+            try:
+                self.q.put_nowait((time.monotonic(), block))
+            except queue.Full:
+                self.overflows += 1
+                FileSource.dropped_total += 1
+
+
+class ClientAudioFeed():
+    """
+    Raw int16 PCM pushed by a remote client in place of a capture device.
+
+    Called like other audio source factories; every source it returns reads
+    from the same buffer, converted to the rate and channel count the reader
+    asks for. put() blocks while max_duration_s of audio is already
+    buffered, so a client that sends faster than the engine consumes is
+    slowed down instead of losing audio. close() ends the input: what is
+    buffered can still be read, and on_drained is called once it is gone.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, sample_rate, channels, max_duration_s=2):
+
+        self.name = f"client-{next(ClientAudioFeed.ids)}"
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_bytes = int(max_duration_s * sample_rate) * channels * 2
+
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.on_drained = None
+        self.drained = False
+
+
+    def __call__(self, sample_rate, channels, blocksize):
+
+        return ClientAudioSource(self, sample_rate, channels, blocksize)
+
+
+    def put(self, data, block=True):
+        """
+        Returns False if the feed is closed, or when block is False and the
+        buffer is full.
+        """
+
+        with self.condition:
+
+            while len(self.buffer) >= self.max_bytes and not self.closed:
+                if not block:
+                    return False
+                self.condition.wait()
+
+            if self.closed:
+                return False
+
+            self.buffer += data
+            self.condition.notify_all()
+
+        return True
+
+
+    def take(self, size, timeout=None):
+
+        with self.condition:
+
+            if not self.condition.wait_for(lambda: len(self.buffer) >= size or self.closed, timeout):
+                return None
+
+            if len(self.buffer) >= size:
+                data = bytes(self.buffer[:size])
+                del self.buffer[:size]
+                self.condition.notify_all()
+                return data
+
+            # closed, and less than a block is left
+            first = not self.drained
+            self.drained = True
+
+        if first and self.on_drained:
+            self.on_drained()
+
+        return None
+
+
+    def pending_bytes(self):
+
+        with self.condition:
+            return len(self.buffer)
+
+
+    def close(self):
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ClientAudioSource():
+
+    def __init__(self, feed, sample_rate, channels, blocksize):
+
+        self.feed = feed
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+
+        # the same duration in the client's format
+        self.feed_block_bytes = max(round(blocksize * feed.sample_rate / sample_rate), 1) * feed.channels * 2
+        self.convert = (sample_rate, channels) != (feed.sample_rate, feed.channels)
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        pass
+
+
+    def read(self, timeout=None):
+
+        data = self.feed.take(self.feed_block_bytes, timeout)
+        if data is None:
+            return None
+
+        if self.convert:
+            data = self.__convert(data)
+
+        return time.monotonic(), data
+
+
+    def pending(self):
+
+        return self.feed.pending_bytes() // self.feed_block_bytes
+
+
+    def overruns(self):
+
+        return 0  # the client is slowed down instead
+
+
+    def __convert(self, data):
+
+        data = utility.convert_pcm(data, self.feed.sample_rate, self.feed.channels, self.sample_rate, self.channels)
+
+        # engines expect exactly one block; rounding in the resampler leaves at most a sample or two to pad
+        block_bytes = self.blocksize * self.channels * 2
+        return data[:block_bytes].ljust(block_bytes, b"\0")
+
+
+class PrerollTap():
+    """
+    Keeps the most recent max_duration_s of audio read from an audio source.
+
+    Wraps an audio source callable. Blocks pass through unchanged and are
+    only referenced by a bounded deque, so reading costs no extra copy;
+    snapshot() joins them when the audio before a detection is needed.
+    Engines open the source in their own format, so the kept audio is in
+    the format of the last opened source, and reopening it in another
+    format starts over.
+    """
+
+    def __init__(self, audio_source, max_duration_s=2):
+
+        self.audio_source = audio_source
+        self.max_duration_s = max_duration_s
+
+        self.blocks = collections.deque()
+        self.size = 0
+        self.max_bytes = 0
+        self.sample_rate = None
+        self.channels = None
+        self.lock = threading.Lock()
+
+
+    def __call__(self, sample_rate, channels, blocksize):
+
+        with self.lock:
+
+            if (sample_rate, channels) != (self.sample_rate, self.channels):
+                self.blocks.clear()
+                self.size = 0
+
+            self.sample_rate = sample_rate
+            self.channels = channels
+            self.max_bytes = int(self.max_duration_s * sample_rate) * channels * 2
+
+        return TappedSource(self, self.audio_source(sample_rate, channels, blocksize))
+
+
+    def add(self, data):
+
+        with self.lock:
+
+            self.blocks.append(data)
+            self.size += len(data)
+
+            while self.blocks and self.size - len(self.blocks[0]) >= self.max_bytes:
+                self.size -= len(self.blocks.popleft())
+
+
+    def snapshot(self):
+        """
+        Returns (pcm, sample_rate, channels).
+        """
+
+        with self.lock:
+            return b"".join(self.blocks), self.sample_rate, self.channels
+
+
+class TappedSource():
+
+    def __init__(self, tap, source):
+
+        self.tap = tap
+        self.source = source
+
+
+    def __enter__(self):
+
+        self.source.__enter__()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        return self.source.__exit__(exc_type, exc_value, traceback)
+
+
+    def read(self, timeout=None):
+
+        item = self.source.read(timeout)
+
+        if item is not None:
+            self.tap.add(item[1])
+
+        return item
+
+
+    def pending(self):
+
+        return self.source.pending()
+
+
+    def overruns(self):
+
+        return self.source.overruns()
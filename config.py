@@ -1,2 +1,114 @@
 
 speech_to_text_url = "http://172.29.198.1:5000/api/stt"
+
+# pool of STT service endpoints (None = speech_to_text_url only)
+speech_to_text_urls = None
+
+# STT endpoint selection ("least_outstanding" or "latency"), and how many consecutive
+# failures eject an endpoint from the pool for how many seconds
+stt_balancing = "least_outstanding"
+stt_eject_failures = 3
+stt_eject_s = 30
+
+# input devices to capture from when a client does not specify any (None = best microphone)
+input_dev_indices = None
+
+# the cached device inventory is rebuilt when this device node directory changes
+# (checked every device_hotplug_poll_s seconds, 0 = never)
+device_hotplug_path = "/dev/snd"
+device_hotplug_poll_s = 5
+
+# WAV files played back in real time instead of capture devices, for load tests
+# (None = real devices); device index i plays file i modulo the number of files
+virtual_audio_files = None
+
+# hard memory cap (in bytes) for a single recording buffer
+recording_max_bytes = 16 * 1024 * 1024
+
+# where hotword engines run: "thread" (in the API process) or "process" (one worker process per pipeline)
+engine_execution = "thread"
+
+# size (in bytes) of the shared-memory audio ring of each engine worker process
+engine_worker_ring_bytes = 4 * 1024 * 1024
+
+# maximum number of outbound messages queued per WebSocket session
+session_queue_size = 256
+
+# threads for blocking session calls (subscribe, unsubscribe), which bounds concurrent session setups
+session_executor_workers = 32
+
+# gRPC transport (grpc_server.py, hotword.proto): port (None = disabled), concurrent Listen streams,
+# seconds of client-streamed audio buffered before the client is held back, and how long a session
+# that closed its audio stream may take to process the rest and transcribe the last utterance
+grpc_port = None
+grpc_max_sessions = 64
+grpc_audio_buffer_s = 2
+grpc_end_of_input_timeout_s = 60
+
+# live detection-score and partial-transcript stream: messages per second and aggregation ("max" or "mean")
+score_stream_rate = 5
+score_stream_aggregate = "max"
+
+# bounds (in milliseconds) of the block duration chosen by adaptive latency control
+adaptive_latency_min_ms = 30
+adaptive_latency_max_ms = 500
+
+# adaptive endpointing: trailing silence (in milliseconds) that ends a short command,
+# extra trailing silence per millisecond of speech heard, and the noise floor (in dBFS)
+# above which the window is stretched because VAD decisions get less reliable
+endpointing_min_silence_ms = 300
+endpointing_silence_per_speech = 0.25
+endpointing_noisy_floor_dbfs = -45
+
+# a recording is only transcribed when VAD found at least this much speech (in milliseconds)
+# and this share of voiced frames; otherwise a "No Speech" event is sent instead
+no_speech_min_voiced_ms = 240
+no_speech_min_voiced_ratio = 0.05
+
+# audio (in milliseconds) kept before the first and after the last voiced frame when
+# leading and trailing silence is trimmed from a recording before transcription
+recording_trim_guard_ms = 200
+
+# batch transcriptions of concurrent sessions: utterances finishing within the window (in
+# milliseconds) are sent as one request to the batch endpoint of the STT service
+stt_batching = False
+stt_batch_window_ms = 50
+stt_batch_max_size = 8
+stt_batch_max_inflight = 2
+
+# local transcription with the loaded Vosk hotword model: "never", "always" or "auto"
+# ("auto" goes local when the remote p95 over the last window exceeds the budget, or the
+# remote call fails); only recordings up to local_stt_max_duration_s are decoded locally
+local_stt = "never"
+local_stt_budget_ms = 800
+local_stt_window_s = 60
+local_stt_max_duration_s = 5
+
+# pre-forked serving mode (prefork.py): number of workers, Vosk models loaded once by the
+# parent and shared copy-on-write, and how often (in seconds) to print per-worker memory
+prefork_workers = 4
+prefork_vosk_models = ["vosk-model-en-us-0.22"]
+prefork_report_s = 60
+
+# threads for concurrent session setup steps (device pipelines and STT model loads)
+session_init_workers = 8
+
+# utterance archive: directory (None = disabled), writer queue length (utterances beyond it
+# are dropped), rotation limits, and seconds of audio kept from before each detection
+archive_dir = None
+archive_queue_size = 32
+archive_max_bytes = 2 * 1024 * 1024 * 1024
+archive_max_age_s = 7 * 24 * 3600
+archive_preroll_s = 2
+
+# how often (in seconds) the custom keyword directories are rescanned for new or changed models
+keyword_poll_s = 5
+
+# CPU admission control: total cores detection pipelines may use (None = no limit), starting
+# estimates of each engine's cost in cores (refined by measurement every cpu_sample_s seconds),
+# cores to pin pipelines to (None = no pinning), and the thread cap of native math libraries
+cpu_budget_cores = None
+engine_cpu_cost = {"vosk": 0.5, "openwakeword": 0.15, "pvporcupine": 0.02}
+cpu_sample_s = 5
+cpu_pin_cores = None
+native_threads = 1
@@ -0,0 +1,208 @@
+
+import os
+import math
+import time
+import threading
+
+from process_memory import cpu_seconds
+
+NATIVE_THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def cap_native_threads(threads):
+    """
+    Limit the thread pools of native math libraries. Only effective before
+    those libraries are loaded, and inherited by engine worker processes.
+    """
+
+    if not threads:
+        return
+
+    for name in NATIVE_THREAD_VARIABLES:
+        os.environ.setdefault(name, str(threads))
+
+
+class CpuScheduler():
+    """
+    CPU budget for detection pipelines.
+
+    Every engine has a CPU cost in cores, which starts at the configured
+    estimate and then follows the measured CPU time of running pipelines.
+    A new pipeline is only admitted when the measured cost of the running
+    ones plus the cost of its engine fits into budget_cores. With a list of
+    cores, each pipeline's detection thread (or engine worker process) is
+    pinned to the least loaded cores, as many as its cost needs.
+    """
+
+    def __init__(self, budget_cores=None, engine_costs=None, cores=None, sample_s=5):
+
+        self.budget_cores = budget_cores
+        self.engine_costs = dict(engine_costs or {})
+        self.cores = list(cores) if cores else []
+        self.sample_s = sample_s
+
+        self.lock = threading.Lock()
+        self.pipelines = {}  # pipeline -> state
+        self.sampler = None
+
+
+    def admit(self, pipeline, engine):
+        """
+        Reserve CPU for a new pipeline. Returns (status, output).
+        """
+
+        with self.lock:
+
+            cost = self.engine_costs.get(engine, 0.0)
+
+            if self.budget_cores is not None:
+                used = sum(state["cost"] for state in self.pipelines.values())
+                if used + cost > self.budget_cores:
+                    return False, (
+                        f"CPU budget exhausted: {used:.2f} of {self.budget_cores:.2f} cores in use, "
+                        f"'{engine}' needs about {cost:.2f}"
+                    )
+
+            self.pipelines[pipeline] = {
+                "engine": engine,
+                "cost": cost,
+                "cores": self.__least_loaded_cores(cost),
+                "tid": None,
+                "pid": None,
+                "cpu": None,
+                "sampled_at": None
+            }
+
+        self.__start_sampler()
+
+        return True, None
+
+
+    def attach(self, pipeline, tid=None, pid=None):
+        """
+        Bind an admitted pipeline to the thread (tid, in this process) or
+        the worker process (pid) that runs its engine, and pin it.
+        """
+
+        with self.lock:
+
+            state = self.pipelines.get(pipeline)
+            if state is None:
+                return
+
+            state["tid"] = tid
+            state["pid"] = pid
+            state["cpu"] = self.__cpu(state)
+            state["sampled_at"] = time.monotonic()
+            cores = state["cores"]
+
+        if not cores:
+            return
+
+        try:
+            # on Linux, 0 pins the calling thread
+            os.sched_setaffinity(pid or 0, set(cores))
+        except (AttributeError, OSError) as e:
+            print(f"Cannot pin pipeline to cores {cores}: {e}")
+
+
+    def release(self, pipeline):
+
+        with self.lock:
+            self.pipelines.pop(pipeline, None)
+
+
+    def report(self):
+
+        with self.lock:
+            return {
+                "budget_cores": self.budget_cores,
+                "used_cores": round(sum(state["cost"] for state in self.pipelines.values()), 3),
+                "engine_costs": {engine: round(cost, 3) for engine, cost in self.engine_costs.items()},
+                "pipelines": [
+                    {"engine": state["engine"], "cost": round(state["cost"], 3), "cores": state["cores"]}
+                    for state in self.pipelines.values()
+                ]
+            }
+
+
+    def __least_loaded_cores(self, cost):
+
+        if not self.cores:
+            return []
+
+        # a pipeline's cost is spread evenly over the cores it is pinned to
+        load = {core: 0.0 for core in self.cores}
+        for state in self.pipelines.values():
+            for core in state["cores"]:
+                if core in load:
+                    load[core] += state["cost"] / len(state["cores"])
+
+        count = min(max(math.ceil(cost), 1), len(self.cores))
+
+        return sorted(sorted(self.cores, key=lambda core: load[core])[:count])
+
+
+    def __cpu(self, state):
+
+        if state["pid"]:
+            return cpu_seconds(state["pid"])
+
+        if state["tid"]:
+            return cpu_seconds("self", state["tid"])
+
+        return None
+
+
+    def __start_sampler(self):
+
+        with self.lock:
+
+            if self.sampler or not self.sample_s:
+                return
+
+            self.sampler = threading.Thread(target=self.__sample_loop, daemon=True)
+            self.sampler.start()
+
+
+    def __sample_loop(self):
+
+        while True:
+
+            time.sleep(self.sample_s)
+
+            with self.lock:
+                self.__sample()
+
+
+    def __sample(self):
+
+        now = time.monotonic()
+        measured = {}
+
+        for state in self.pipelines.values():
+
+            cpu = self.__cpu(state)
+            if cpu is None or state["cpu"] is None:
+                continue
+
+            elapsed = now - state["sampled_at"]
+            if elapsed <= 0:
+                continue
+
+            state["cost"] = max(cpu - state["cpu"], 0.0) / elapsed
+            state["cpu"] = cpu
+            state["sampled_at"] = now
+
+            measured.setdefault(state["engine"], []).append(state["cost"])
+
+        # the estimate for new pipelines follows what running ones actually use
+        for engine, costs in measured.items():
+            average = sum(costs) / len(costs)
+            previous = self.engine_costs.get(engine)
+            self.engine_costs[engine] = average if previous is None else 0.7 * previous + 0.3 * average
@@ -0,0 +1,174 @@
+
+import os
+import time
+import threading
+import sounddevice as sd
+
+import config
+import utility
+
+
+class DeviceInventory():
+    """
+    Cached inventory of the audio devices.
+
+    The device list, the host API names, the outcome of each trial open and
+    the best microphone are gathered once and shared by all sessions. The
+    cache is rebuilt after a hotplug (a change in the device node directory)
+    or an explicit refresh(). PortAudio only sees added or removed devices
+    after it is reinitialized, which must not happen while a stream is open,
+    so a rebuild after a hotplug waits until idle_check() reports no open
+    capture stream.
+    """
+
+    def __init__(self, hotplug_path="/dev/snd", poll_s=5):
+
+        self.hotplug_path = hotplug_path
+        self.poll_s = poll_s
+        self.idle_check = None
+
+        self.lock = threading.RLock()
+        self.devices = None
+        self.infos = {}
+        self.probes = {}
+        self.best = None
+        self.stale = False
+        self.watcher = None
+
+
+    def get_audio_devices(self):
+
+        with self.lock:
+            self.__ensure()
+            return self.devices
+
+
+    def get_device_info(self, dev_index):
+
+        with self.lock:
+            self.__ensure()
+            return self.infos.get(dev_index)
+
+
+    def get_default_input_device(self):
+
+        default_input, _ = sd.default.device
+        return self.get_device_info(default_input)
+
+
+    def select_best_microphone(self):
+
+        with self.lock:
+
+            self.__ensure()
+
+            if self.best is None:
+                mic_only, _, input_output = self.devices
+                self.best = utility.select_best_microphone(mic_only, input_output, probe=self.__probe)
+
+            return self.best
+
+
+    def refresh(self):
+        """
+        Rebuild the inventory now. Returns True when PortAudio was
+        reinitialized, so added or removed devices are visible.
+        """
+
+        with self.lock:
+            return self.__rebuild(self.__idle())
+
+
+    def report(self):
+
+        with self.lock:
+
+            self.__ensure()
+
+            return {
+                "best": self.best,
+                "stale": self.stale,
+                "devices": [
+                    {**info, "usable": self.probes.get(index)}
+                    for index, info in sorted(self.infos.items())
+                ]
+            }
+
+
+    def __ensure(self):
+
+        if self.devices is None:
+            self.__rebuild(False)
+
+        elif self.stale and self.__idle():
+            print("Audio devices changed, rebuilding the device inventory")
+            self.__rebuild(True)
+
+        self.__start_watcher()
+
+
+    def __rebuild(self, reinitialize):
+
+        if reinitialize:
+            sd._terminate()
+            sd._initialize()
+
+        self.devices = utility.get_audio_devices()
+        self.infos = {
+            info["index"]: info
+            for group in self.devices
+            for infos in group.values()
+            for info in infos
+        }
+        self.probes = {}
+        self.best = None
+
+        if reinitialize:
+            self.stale = False
+
+        return reinitialize
+
+
+    def __idle(self):
+
+        return self.idle_check is not None and self.idle_check()
+
+
+    def __probe(self, dev):
+
+        if dev["index"] not in self.probes:
+            self.probes[dev["index"]] = utility.probe_input_device(dev)
+
+        return self.probes[dev["index"]]
+
+
+    def __start_watcher(self):
+
+        if self.watcher or not self.poll_s or not os.path.isdir(self.hotplug_path):
+            return
+
+        self.watcher = threading.Thread(target=self.__watch, daemon=True)
+        self.watcher.start()
+
+
+    def __watch(self):
+
+        last = os.stat(self.hotplug_path).st_mtime_ns
+
+        while True:
+
+            time.sleep(self.poll_s)
+
+            try:
+                current = os.stat(self.hotplug_path).st_mtime_ns
+            except OSError:
+                continue
+
+            if current != last:
+                last = current
+                with self.lock:
+                    self.stale = True
+
+
+# shared by all pipelines of the process
+inventory = DeviceInventory(config.device_hotplug_path, config.device_hotplug_poll_s)
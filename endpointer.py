@@ -0,0 +1,100 @@
+
+import math
+
+# lowest level fed into the noise floor estimate, digital silence reads -inf dBFS
+MIN_FRAME_DBFS = -100
+
+
+class Endpointer():
+    """
+    Decides when an utterance has ended from per-frame VAD decisions.
+
+    In "fixed" mode the recording ends after silence_duration_s of
+    continuous silence, as before. In "adaptive" mode the trailing-silence
+    window grows with the amount of speech heard so far: short commands end
+    after a few hundred milliseconds while long dictation keeps a longer
+    window, capped at silence_duration_s. The window is stretched when the
+    estimated noise floor is high, because VAD decisions are less reliable
+    in noisy rooms. Until speech starts, silence_duration_s applies.
+    """
+
+    def __init__(
+        self,
+        silence_duration_s=3,
+        mode="fixed",
+        min_silence_ms=300,
+        silence_per_speech=0.25,
+        noisy_floor_dbfs=-45,
+        noisy_factor=1.5):
+
+        if mode not in ("fixed", "adaptive"):
+            raise ValueError(f"Unknown endpointing mode '{mode}'. Choose from ['fixed', 'adaptive']")
+
+        self.mode = mode
+        self.max_silence_ms = silence_duration_s * 1000
+        self.min_silence_ms = min(min_silence_ms, self.max_silence_ms)
+        self.silence_per_speech = silence_per_speech
+        self.noisy_floor_dbfs = noisy_floor_dbfs
+        self.noisy_factor = noisy_factor
+
+        self.speech_ms = 0
+        self.total_ms = 0
+        self.silence_ms = 0
+        self.noise_floor_dbfs = None
+
+
+    def update(self, is_speech, frame_ms, frame_dbfs=None):
+        """
+        Feed one VAD frame. Returns True once the utterance has ended.
+        """
+
+        self.total_ms += frame_ms
+
+        if is_speech:
+            self.speech_ms += frame_ms
+            self.silence_ms = 0
+            return False
+
+        self.silence_ms += frame_ms
+
+        if frame_dbfs is not None:
+            # one -inf frame would otherwise pin the average there for good
+            frame_dbfs = max(frame_dbfs, MIN_FRAME_DBFS)
+            if self.noise_floor_dbfs is None:
+                self.noise_floor_dbfs = frame_dbfs
+            else:
+                self.noise_floor_dbfs = 0.95 * self.noise_floor_dbfs + 0.05 * frame_dbfs
+
+        return self.silence_ms > self.window_ms()
+
+
+    def window_ms(self):
+        """
+        Trailing silence (in milliseconds) that ends the utterance.
+        """
+
+        if self.mode == "fixed" or self.speech_ms == 0:
+            return self.max_silence_ms
+
+        window = self.min_silence_ms + self.silence_per_speech * self.speech_ms
+
+        if self.noise_floor_dbfs is not None and self.noise_floor_dbfs > self.noisy_floor_dbfs:
+            window *= self.noisy_factor
+
+        return min(window, self.max_silence_ms)
+
+
+    @staticmethod
+    def dbfs(samples):
+        """
+        RMS level of int16 samples in dBFS.
+        """
+
+        if len(samples) == 0:
+            return -math.inf
+
+        rms = math.sqrt(float((samples.astype("float64") ** 2).mean()))
+        if rms == 0:
+            return -math.inf
+
+        return 20 * math.log10(rms / 32768)
@@ -1,47 +1,96 @@
 
 import os
-import sys
-import queue
-import gc
+import time
+import threading
+import functools
 import numpy as np
-import sounddevice as sd
 import openwakeword
 from openwakeword.model import Model
 
-import utility
+import config
+from audio_source import MicrophoneSource
+from keyword_index import KeywordIndex
+from process_memory import current_rss
+from latency_controller import LatencyController
+from hotword_types import TimelineStage
+
+
+def inference_framework(model_paths):
+
+    frameworks = {"onnx" if path.endswith(".onnx") else "tflite" for path in model_paths}
+    if len(frameworks) > 1:
+        raise ValueError("cannot mix .tflite and .onnx keyword models in one session")
+
+    return frameworks.pop() if frameworks else "tflite"
 
 
 class OpenwakewordEngine:
 
-    def __init__(self):
+    # custom keyword models, indexed once and shared by all engine instances
+    keyword_index = None
+    keyword_index_lock = threading.Lock()
 
-        self.q = queue.Queue(maxsize=50)
+    # RSS growth measured the first time each keyword set loaded; later loads
+    # reuse pages freed by the previous utterance's model, so they would read as 0
+    models_bytes = {}
+
+    def __init__(self):
 
         self.openwakeword_model = None
+        self.model_bytes = None
 
         self.dev_index = None
         self.dev_sample_rate = None
         self.dev_channels = None
+        self.audio_source = None
 
-        script_path = os.path.abspath(__file__)
-        script_dir = os.path.dirname(script_path)
+        self.builtin_keyword_paths = { k: v["model_path"] for k, v in openwakeword.MODELS.items() }
 
-        custom_keyword_path_dir = os.path.join(script_dir, "openwakeword_keywords")
 
-        my_keyword_path = {
-            "hey agent": os.path.join(custom_keyword_path_dir, "my_model.tflite")
-        }
+    @property
+    def keyword_path_all(self):
+
+        # custom models are looked up per session, so new ones are picked up without a restart
+        return {**OpenwakewordEngine.custom_keywords().paths(), **self.builtin_keyword_paths}
+
+
+    @classmethod
+    def custom_keywords(cls):
+
+        with cls.keyword_index_lock:
+
+            if cls.keyword_index is None:
+                cls.keyword_index = KeywordIndex(
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "openwakeword_keywords"),
+                    (".tflite", ".onnx"),
+                    validate=cls.validate_keyword_model,
+                    poll_s=config.keyword_poll_s)
+
+            return cls.keyword_index
+
+
+    @classmethod
+    def use_keywords(cls, keywords):
+        """
+        Use keywords validated elsewhere (a keyword_index.KeywordSnapshot)
+        instead of scanning the keyword directory.
+        """
+
+        with cls.keyword_index_lock:
+            cls.keyword_index = keywords
 
-        my_keyword_path = {
-            k: v for k, v in my_keyword_path.items()
-            if os.path.isfile(v)
-        }
 
-        model_paths = { k: v["model_path"] for k, v in openwakeword.MODELS.items() }
-        self.keyword_path_all = {**my_keyword_path, **model_paths}
+    @staticmethod
+    def validate_keyword_model(path):
 
+        # the shared feature models must be present to build a keyword model
+        openwakeword.utils.download_models()
 
-    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels):
+        Model(wakeword_models=[path], inference_framework=inference_framework([path]))
+        return True, None
+
+
+    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels, audio_source=None):
 
         if model_name:
             return False, f"'{model_name}' is not a valid model in Openwakeword."
@@ -49,6 +98,7 @@ class OpenwakewordEngine:
         self.dev_index = dev_index
         self.dev_sample_rate = dev_sample_rate
         self.dev_channels = dev_channels
+        self.audio_source = audio_source or functools.partial(MicrophoneSource, dev_index)
 
         print(f"\n🔄 Loading Openwakeword models...")
 
@@ -63,40 +113,69 @@ class OpenwakewordEngine:
         return True, None
 
 
-    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None):
+    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None, timeline=None, hotword_confidence=None, score_stream=None, latency=None):
+
+        _ = hotword_confidence  # per-word confidence only applies to Vosk
+
+        keyword_path_all = self.keyword_path_all
 
         keyword_paths = []
         for hotword in hotword_list:
-            if hotword not in self.keyword_path_all:
-                return False, f"invalid keyword '{hotword}'. Choose from {list(self.keyword_path_all.keys())}"
-            keyword_paths.append(self.keyword_path_all[hotword])
+            if hotword not in keyword_path_all:
+                if hotword in OpenwakewordEngine.custom_keywords().pending():
+                    return False, f"keyword '{hotword}' is still being validated. Try again shortly."
+                return False, f"invalid keyword '{hotword}'. Choose from {list(keyword_path_all.keys())}"
+            keyword_paths.append(keyword_path_all[hotword])
+
+        self.__release_model()
+
+        key = tuple(sorted(keyword_paths))
+
+        try:
+            rss = current_rss()
+            self.openwakeword_model = Model(
+                wakeword_models=keyword_paths,
+                inference_framework=inference_framework(keyword_paths))
+            if key not in OpenwakewordEngine.models_bytes:
+                OpenwakewordEngine.models_bytes[key] = max(current_rss() - rss, 0)
+            self.model_bytes = OpenwakewordEngine.models_bytes[key]
+        except Exception as e:
+            return False, f"Openwakeword model failed: {e}"
 
-        self.openwakeword_model = Model(wakeword_models=keyword_paths)
+        # predictions are keyed by model file name, sessions know the keyword names
+        keyword_names = {
+            os.path.splitext(os.path.basename(path))[0]: hotword
+            for hotword, path in zip(hotword_list, keyword_paths)
+        }
 
         sample_rate = 16000  # OpenWakeWord expects 16kHz audio
-        blocksize = utility.choose_blocksize(target_latency_ms, sample_rate)
 
-        self.__empty_queue()
+        latency = latency or LatencyController(target_latency_ms)
+        blocksize = latency.blocksize(sample_rate)
+
         detected_hotword = None
 
-        with sd.RawInputStream(
-            device=self.dev_index,
-            samplerate=sample_rate,
-            blocksize=blocksize,
-            dtype='int16',
-            channels=1,
-            callback=self.__audio_callback):
+        with self.audio_source(sample_rate, 1, blocksize) as source:
 
             while not script_state["interrupted"]:
 
-                data = self.q.get()
+                item = latency.read(source, timeout=0.5)
+                if item is None:
+                    continue
+
+                captured_at, data = item
 
                 if len(data) < blocksize * 2:  # 2 bytes per sample
                     continue
 
                 audio_frame = np.frombuffer(data, dtype=np.int16)
 
+                started = time.perf_counter()
                 predictions  = self.openwakeword_model.predict(audio_frame)
+                latency.observe(source, time.perf_counter() - started)
+
+                if score_stream and score_stream.active():
+                    score_stream.add_scores(predictions)
 
                 filtered = sorted(
                     [(name, score) for name, score in predictions.items() if score >= 0.5],
@@ -112,10 +191,15 @@ class OpenwakewordEngine:
                     name, score = filtered[0]
                     print(f"🔊 Hotword detected: {name} (score: {score:.2f})")
 
-                    detected_hotword = name
+                    detected_hotword = keyword_names.get(name, name)
+                    if timeline:
+                        timeline.mark(TimelineStage.AUDIO_CAPTURED, captured_at)
+                        timeline.mark(TimelineStage.HOTWORD_SCORED)
                     break
 
         if detected_hotword:
+            if timeline:
+                timeline.mark(TimelineStage.HOTWORD_FIRED)
             if on_hotword_callback:
                 on_hotword_callback(detected_hotword)
 
@@ -124,27 +208,26 @@ class OpenwakewordEngine:
 
     def stop_hotword_detection(self):
 
-        if self.openwakeword_model:
-            self.openwakeword_model = None
+        self.__release_model()
 
-        gc.collect()
 
+    def resources(self):
 
-    def __audio_callback(self, indata, frames, time_info, status):
+        return {
+            "model": list(self.openwakeword_model.models) if self.openwakeword_model else None,
+            "model_bytes": self.model_bytes
+        }
 
-        if status:
-            print(f"[STATUS] {status}", file=sys.stderr)
 
-        try:
-            self.q.put_nowait(bytes(indata))
-        except queue.Full:
-            print("[WARN] Audio queue full — dropping frame")
+    def __release_model(self):
 
+        if not self.openwakeword_model:
+            return
 
-    def __empty_queue(self):
+        # drop the interpreters explicitly, they are freed even if the model is still referenced elsewhere
+        models = getattr(self.openwakeword_model, "models", None)
+        if isinstance(models, dict):
+            models.clear()
 
-        while not self.q.empty():
-            try:
-                self.q.get_nowait()
-            except queue.Empty:
-                break
+        self.openwakeword_model = None
+        self.model_bytes = None
@@ -1,45 +1,92 @@
 
 import os
-import gc
 import struct
-import sounddevice as sd
+import functools
+import time
+import threading
 from dotenv import load_dotenv
 import pvporcupine
 
+import config
 import utility
+from audio_source import MicrophoneSource
+from keyword_index import KeywordIndex
+from process_memory import current_rss
+from latency_controller import LatencyController
+from hotword_types import TimelineStage
 
 load_dotenv()
 
 
 class PvporcupineEngine:
 
+    # custom keyword models, indexed once and shared by all engine instances
+    keyword_index = None
+    keyword_index_lock = threading.Lock()
+
+    # RSS growth measured the first time each keyword set loaded; later loads
+    # reuse pages freed by the previous utterance's model, so they would read as 0
+    models_bytes = {}
+
     def __init__(self):
 
         self.pvporcupine_model = None
+        self.model_bytes = None
 
         self.dev_index = None
         self.dev_sample_rate = None
         self.dev_channels = None
         self.access_key = None
+        self.audio_source = None
 
-        script_path = os.path.abspath(__file__)
-        script_dir = os.path.dirname(script_path)
 
-        custom_keyword_path_dir = os.path.join(script_dir, "pvporcupine_keywords")
+    @property
+    def keyword_path_all(self):
 
-        my_keyword_path = {
-            "hey agent": os.path.join(custom_keyword_path_dir, "hey-agent_en_linux_v3_0_0.ppn")
-        }
+        # custom models are looked up per session, so new ones are picked up without a restart
+        return {**PvporcupineEngine.custom_keywords().paths(), **pvporcupine.KEYWORD_PATHS}
 
-        my_keyword_path = {
-            k: v for k, v in my_keyword_path.items()
-            if os.path.isfile(v)
-        }
 
-        self.keyword_path_all = {**my_keyword_path, **pvporcupine.KEYWORD_PATHS}
+    @classmethod
+    def custom_keywords(cls):
+
+        with cls.keyword_index_lock:
+
+            if cls.keyword_index is None:
+                cls.keyword_index = KeywordIndex(
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pvporcupine_keywords"),
+                    (".ppn",),
+                    validate=cls.validate_keyword_model,
+                    poll_s=config.keyword_poll_s)
+
+            return cls.keyword_index
+
+
+    @classmethod
+    def use_keywords(cls, keywords):
+        """
+        Use keywords validated elsewhere (a keyword_index.KeywordSnapshot)
+        instead of scanning the keyword directory.
+        """
+
+        with cls.keyword_index_lock:
+            cls.keyword_index = keywords
+
+
+    @staticmethod
+    def validate_keyword_model(path):
+
+        access_key = os.getenv('Pvporcupine_API_KEY', None)
+        if not access_key:
+            return True, None  # cannot be checked without a key, the session reports the error
+
+        model = pvporcupine.create(access_key=access_key, keyword_paths=[path])
+        model.delete()
+
+        return True, None
 
 
-    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels):
+    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels, audio_source=None):
 
         if model_name:
             return False, f"'{model_name}' is not a valid model in Pvporcupine."
@@ -47,6 +94,7 @@ class PvporcupineEngine:
         self.dev_index = dev_index
         self.dev_sample_rate = dev_sample_rate
         self.dev_channels = dev_channels
+        self.audio_source = audio_source or functools.partial(MicrophoneSource, dev_index)
 
         self.access_key = os.getenv('Pvporcupine_API_KEY', None)
         if not self.access_key:
@@ -55,51 +103,83 @@ class PvporcupineEngine:
         return True, None
 
 
-    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None):
+    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None, timeline=None, hotword_confidence=None, score_stream=None, latency=None):
 
-        _ = target_latency_ms
+        _ = hotword_confidence  # per-word confidence only applies to Vosk
+        _ = score_stream  # Porcupine does not expose detection scores
+
+        keyword_path_all = self.keyword_path_all
 
         keyword_paths = []
         for hotword in hotword_list:
-            if hotword not in self.keyword_path_all:
-                return False, f"invalid keyword '{hotword}'. Choose from {list(self.keyword_path_all.keys())}"
-            keyword_paths.append(self.keyword_path_all[hotword])
+            if hotword not in keyword_path_all:
+                if hotword in PvporcupineEngine.custom_keywords().pending():
+                    return False, f"keyword '{hotword}' is still being validated. Try again shortly."
+                return False, f"invalid keyword '{hotword}'. Choose from {list(keyword_path_all.keys())}"
+            keyword_paths.append(keyword_path_all[hotword])
+
+        # the handle of the previous utterance holds native memory until deleted
+        self.__release_model()
+
+        key = tuple(sorted(keyword_paths))
 
         try:
 
+            rss = current_rss()
             self.pvporcupine_model = pvporcupine.create(
                 access_key=self.access_key,
                 keyword_paths=keyword_paths
             )
+            if key not in PvporcupineEngine.models_bytes:
+                PvporcupineEngine.models_bytes[key] = max(current_rss() - rss, 0)
+            self.model_bytes = PvporcupineEngine.models_bytes[key]
 
         except Exception as e:
             return False, f"Pvporcupine Create failed: {e}"
 
         frame_length = self.pvporcupine_model.frame_length
         sample_rate = self.pvporcupine_model.sample_rate
+        frame_bytes = frame_length * 2
         detected_hotword = None
 
-        with sd.RawInputStream(
-            device=self.dev_index,
-            samplerate=sample_rate,
-            blocksize=frame_length,
-            dtype='int16',
-            channels=1) as stream:
+        # Porcupine needs its own frame length, so only the processing batch adapts
+        latency = latency or LatencyController(target_latency_ms)
+        blocksize = latency.blocksize(sample_rate, fixed=frame_length)
+
+        with self.audio_source(sample_rate, 1, blocksize) as source:
 
             while not script_state["interrupted"]:
 
-                data, _ = stream.read(frame_length)
+                item = latency.read(source, timeout=0.5)
+                if item is None:
+                    continue
+
+                captured_at, data = item
+                keyword_index = -1
+
+                started = time.perf_counter()
+
+                for offset in range(0, len(data) - frame_bytes + 1, frame_bytes):
+
+                    # Convert raw bytes to a list of 16-bit samples
+                    audio_frame = struct.unpack_from("h" * frame_length, data, offset)
 
-                # Convert raw bytes to a list of 16-bit samples
-                audio_frame = struct.unpack_from("h" * frame_length, data)
+                    keyword_index = self.pvporcupine_model.process(audio_frame)
+                    if keyword_index >= 0:
+                        break
 
-                keyword_index = self.pvporcupine_model.process(audio_frame)
+                latency.observe(source, time.perf_counter() - started)
 
                 if keyword_index >= 0:
                     detected_hotword = hotword_list[keyword_index]
+                    if timeline:
+                        timeline.mark(TimelineStage.AUDIO_CAPTURED, captured_at)
+                        timeline.mark(TimelineStage.HOTWORD_SCORED)
                     break
 
         if detected_hotword:
+            if timeline:
+                timeline.mark(TimelineStage.HOTWORD_FIRED)
             if on_hotword_callback:
                 on_hotword_callback(detected_hotword)
 
@@ -108,8 +188,20 @@ class PvporcupineEngine:
 
     def stop_hotword_detection(self):
 
+        self.__release_model()
+
+
+    def resources(self):
+
+        return {
+            "model": "porcupine" if self.pvporcupine_model else None,
+            "model_bytes": self.model_bytes
+        }
+
+
+    def __release_model(self):
+
         if self.pvporcupine_model:
             self.pvporcupine_model.delete()
             self.pvporcupine_model = None
-
-        gc.collect()
+            self.model_bytes = None
@@ -1,40 +1,55 @@
 
-import sys
 import json
-import queue
 import threading
-import gc
-import sounddevice as sd
+import functools
+import time
+from concurrent.futures import Future
 from vosk import Model, KaldiRecognizer
 
-import utility
+from audio_source import MicrophoneSource
+from phrase_matcher import PhraseMatcher
+from latency_controller import LatencyController
+from hotword_types import TimelineStage
+from process_memory import current_rss
 
 
 class VoskEngine:
 
-    def __init__(self):
+    # loaded models are shared by all engine instances (one per input device): name -> Future
+    models = {}
+    models_refs = {}
+    models_bytes = {}  # RSS growth measured while each model loaded
+    models_lock = threading.Lock()
 
-        self.q = queue.Queue(maxsize=50)
+    def __init__(self):
 
         self.vosk_model = None
+        self.vosk_model_name = None
         self.vosk_recognizer = None
 
         self.dev_index = None
         self.dev_sample_rate = None
         self.dev_channels = None
+        self.audio_source = None
 
 
-    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels):
+    def init_model(self, model_name, dev_index, dev_sample_rate, dev_channels, audio_source=None):
 
         self.dev_index = dev_index
         self.dev_sample_rate = dev_sample_rate
         self.dev_channels = dev_channels
+        self.audio_source = audio_source or functools.partial(MicrophoneSource, dev_index)
 
         print(f"\n🔄 Loading Vosk model '{model_name}'...")
 
         try:
 
-            self.vosk_model = Model(model_name=model_name)
+            if self.vosk_model_name:
+                VoskEngine.release_model(self.vosk_model_name)
+                self.vosk_model_name = None
+
+            self.vosk_model = VoskEngine.acquire_model(model_name)
+            self.vosk_model_name = model_name
             self.vosk_recognizer = KaldiRecognizer(self.vosk_model, self.dev_sample_rate)
             self.vosk_recognizer.SetWords(True) # enable word-level recognition output
 
@@ -44,26 +59,33 @@ class VoskEngine:
         return True, None
 
 
-    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None):
+    def start_hotword_detection(self, hotword_list, target_latency_ms, script_state, on_hotword_callback=None, timeline=None, hotword_confidence=None, score_stream=None, latency=None):
+
+        latency = latency or LatencyController(target_latency_ms)
+        blocksize = latency.blocksize(self.dev_sample_rate, self.dev_channels)
 
-        blocksize = utility.choose_blocksize(target_latency_ms, self.dev_sample_rate)
+        try:
+            matcher = PhraseMatcher(hotword_list, hotword_confidence)
+        except ValueError as e:
+            return False, str(e)
 
-        self.__empty_queue()
-        detected_hotword = None
+        detected_hotwords = []
 
-        with sd.RawInputStream(
-            device=self.dev_index,
-            samplerate=self.dev_sample_rate,
-            blocksize=blocksize,
-            dtype='int16',
-            channels=self.dev_channels,
-            callback=self.__audio_callback):
+        with self.audio_source(self.dev_sample_rate, self.dev_channels, blocksize) as source:
 
             while not script_state["interrupted"]:
 
-                data = self.q.get()
+                item = latency.read(source, timeout=0.5)
+                if item is None:
+                    continue
+
+                captured_at, data = item
+
+                started = time.perf_counter()
+                accepted = self.vosk_recognizer.AcceptWaveform(data)
+                latency.observe(source, time.perf_counter() - started)
 
-                if self.vosk_recognizer.AcceptWaveform(data):
+                if accepted:
 
                     result = json.loads(self.vosk_recognizer.Result())
                     text = result.get("text", "").lower()
@@ -73,49 +95,129 @@ class VoskEngine:
 
                     print(f"[VOICE] {text}")
 
-                    for word in hotword_list:
-                        if word in text:
-                            print(f"🔊 Hotword detected: {word}")
-                            detected_hotword = word
-                            break
+                    matches = matcher.match(PhraseMatcher.words_from_result(result))
 
-                    if detected_hotword:
+                    for match in matches:
+                        print(f"🔊 Hotword detected: {match['phrase']} (conf: {match['conf']:.2f})")
+                        detected_hotwords.append(match["phrase"])
+
+                    if detected_hotwords:
+                        if timeline:
+                            timeline.mark(TimelineStage.AUDIO_CAPTURED, captured_at)
+                            timeline.mark(TimelineStage.HOTWORD_SCORED)
                         break  # break while loop
 
-                else:
-                    # partial results:
-                    # partial = json.loads(recognizer.PartialResult())["partial"]
-                    pass
+                elif score_stream and score_stream.active():
+                    partial = json.loads(self.vosk_recognizer.PartialResult()).get("partial", "")
+                    score_stream.set_partial(partial)
 
-        if detected_hotword:
+        if detected_hotwords:
+            if timeline:
+                timeline.mark(TimelineStage.HOTWORD_FIRED)
             if on_hotword_callback:
-                on_hotword_callback(detected_hotword)
+                for detected_hotword in detected_hotwords:
+                    on_hotword_callback(detected_hotword)
 
         return True, None
 
 
+    def transcribe(self, pcm, sample_rate):
+        """
+        Decode a whole recording with the already loaded model.
+        """
+
+        if self.vosk_model is None:
+            return False, "Vosk model is not loaded"
+
+        recognizer = KaldiRecognizer(self.vosk_model, sample_rate)
+        recognizer.AcceptWaveform(bytes(pcm))
+
+        result = json.loads(recognizer.FinalResult())
+
+        return True, result.get("text", "")
+
+
     def stop_hotword_detection(self):
 
+        # the recognizer frees its Kaldi decoder as soon as the last reference goes
         self.vosk_recognizer = None
         self.vosk_model = None
-        gc.collect()
 
+        if self.vosk_model_name:
+            VoskEngine.release_model(self.vosk_model_name)
+            self.vosk_model_name = None
 
-    def __audio_callback(self, indata, frames, time_info, status):
 
-        if status:
-            print(f"[STATUS] {status}", file=sys.stderr)
+    def resources(self):
 
-        try:
-            self.q.put_nowait(bytes(indata))
-        except queue.Full:
-            print("[WARN] Audio queue full — dropping frame")
+        return {
+            "model": self.vosk_model_name,
+            "model_bytes": VoskEngine.models_bytes.get(self.vosk_model_name),
+            "model_shared_by": VoskEngine.models_refs.get(self.vosk_model_name)
+        }
 
 
-    def __empty_queue(self):
+    @classmethod
+    def model_report(cls):
+
+        with cls.models_lock:
+            return [
+                {"engine": "vosk", "model": name, "model_bytes": cls.models_bytes.get(name), "refs": cls.models_refs[name]}
+                for name, future in cls.models.items()
+                if future.done() and not future.exception()
+            ]
+
+
+    @classmethod
+    def acquire_model(cls, model_name):
+        """
+        Concurrent requests for the same model share one load. The lock is
+        only held for bookkeeping, so other models load and release meanwhile.
+        """
+
+        with cls.models_lock:
+
+            future = cls.models.get(model_name)
+            owner = future is None
+            if owner:
+                future = Future()
+                cls.models[model_name] = future
+                cls.models_refs[model_name] = 0
+
+            cls.models_refs[model_name] += 1
+
+        if owner:
 
-        while not self.q.empty():
             try:
-                self.q.get_nowait()
-            except queue.Empty:
-                break
+                rss = current_rss()
+                model = Model(model_name=model_name)
+                model_bytes = max(current_rss() - rss, 0)
+            except Exception as e:
+                # the next session tries again
+                with cls.models_lock:
+                    del cls.models[model_name]
+                    del cls.models_refs[model_name]
+                future.set_exception(e)
+                raise
+
+            with cls.models_lock:
+                cls.models_bytes[model_name] = model_bytes
+            future.set_result(model)
+
+        return future.result()
+
+
+    @classmethod
+    def release_model(cls, model_name):
+
+        with cls.models_lock:
+
+            if model_name not in cls.models:
+                return
+
+            cls.models_refs[model_name] -= 1
+
+            if cls.models_refs[model_name] <= 0:
+                del cls.models[model_name]
+                del cls.models_refs[model_name]
+                cls.models_bytes.pop(model_name, None)
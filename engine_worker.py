@@ -0,0 +1,442 @@
+
+import sys
+import time
+import queue
+import threading
+import multiprocessing
+import sounddevice as sd
+
+import config
+from audio_source import SharedAudioRing, SharedMemorySource
+from hotword_models import HotwordModel, ENGINES, create_stt_client
+from process_memory import memory_usage
+
+mp_context = multiprocessing.get_context("spawn")
+
+
+class ProcessHotwordModel(HotwordModel):
+    """
+    HotwordModel whose engine runs in a dedicated worker process.
+
+    Device selection and audio capture stay in the API process. Captured
+    blocks are written to a shared-memory ring that the worker reads, and
+    events and commands travel over a pipe. The engine loop therefore does
+    not contend for the GIL of the API process, and a crashing native
+    engine only takes down its own worker.
+    """
+
+    def __init__(self, stt_client=None):
+
+        super().__init__(stt_client)
+
+        self.process = None
+        self.conn = None
+        self.ring = None
+        self.stream = None
+        self.reader = None
+
+        self.send_lock = threading.Lock()
+        self.stream_lock = threading.Lock()
+        self.replies = queue.Queue()
+        self.callbacks = {}
+
+
+    def init_audio_device(self, dev_index=None, dev_input_callback=None):
+
+        # the API process captures from the device for the worker, and it can only do so from a real one
+        if config.virtual_audio_files:
+            return False, "virtual audio files need engine_execution 'thread'"
+
+        return super().init_audio_device(dev_index, dev_input_callback)
+
+
+    def init_audio_stream(self, feed, dev_input_callback=None):
+
+        return False, "client audio streams need engine_execution 'thread'"
+
+
+    def init_hotword(
+        self,
+        model_engine_hotword="vosq",
+        model_name_hotword="vosk-model-en-us-0.22",
+        model_engine_stt="openai_whisper",
+        model_name_stt="small.en",
+        local_stt="never",
+        load_stt=True):
+
+        if self.input_dev_index is None:
+            return False, "audio device is not initialized!"
+
+        self.__start_worker()
+
+        # custom keyword models are already validated in this process
+        engine = ENGINES.get(model_engine_hotword)
+        keywords = engine.custom_keywords().snapshot() if hasattr(engine, "custom_keywords") else None
+
+        # the STT model is loaded from this process, where concurrent loads are shared
+        status, output = self.__call(
+            "init_hotword",
+            keywords=keywords,
+            model_engine_hotword=model_engine_hotword,
+            model_name_hotword=model_name_hotword,
+            model_engine_stt=model_engine_stt,
+            model_name_stt=model_name_stt,
+            local_stt=local_stt,
+            load_stt=False)
+
+        if not status or not load_stt:
+            return status, output
+
+        return self.load_stt_model(model_engine_stt, model_name_stt)
+
+
+    def detect_hotword_and_transcribe(
+        self,
+        hotword_list,
+        on_hotword_callback=None,
+        on_silence_callback=None,
+        on_transcription_callback=None,
+        target_latency_ms=100,
+        silence_duration_s=3,
+        on_timeline_callback=None,
+        max_recording_s=30,
+        recording_overflow="cut",
+        hotword_confidence=None,
+        on_scores_callback=None,
+        on_partial_callback=None,
+        adaptive_latency=False,
+        on_latency_callback=None,
+        endpointing="fixed",
+        on_no_speech_callback=None):
+
+        if not self.process:
+            return False, "hotword detection is not initialized!"
+
+        self.callbacks = {
+            "hotword": on_hotword_callback,
+            "silence": on_silence_callback,
+            "transcription": on_transcription_callback,
+            "timeline": on_timeline_callback,
+            "scores": on_scores_callback,
+            "partial": on_partial_callback,
+            "latency": on_latency_callback,
+            "no_speech": on_no_speech_callback
+        }
+
+        return self.__call(
+            "detect_hotword_and_transcribe",
+            hotword_list=hotword_list,
+            target_latency_ms=target_latency_ms,
+            silence_duration_s=silence_duration_s,
+            endpointing=endpointing,
+            timeline=on_timeline_callback is not None,
+            scores=on_scores_callback is not None,
+            partial=on_partial_callback is not None,
+            latency=on_latency_callback is not None,
+            adaptive_latency=adaptive_latency,
+            max_recording_s=max_recording_s,
+            recording_overflow=recording_overflow,
+            hotword_confidence=hotword_confidence)
+
+
+    def resources(self):
+
+        if not self.process:
+            return {"worker_pid": None}
+
+        return {
+            "worker_pid": self.process.pid,
+            "worker_memory": memory_usage(self.process.pid),
+            "ring_bytes": self.ring.shm.size if self.ring else 0
+        }
+
+
+    def interrupt(self):
+
+        if not self.process:
+            return
+
+        try:
+            self.__send(("stop",))
+        except (OSError, ValueError):
+            pass
+
+
+    def want_scores(self, wanted):
+
+        super().want_scores(wanted)
+
+        if not self.process:
+            return
+
+        try:
+            self.__send(("want_scores", wanted))
+        except (OSError, ValueError):
+            pass
+
+
+    def stop_hotword_detection(self):
+
+        print("Stopping hotword detection...")
+
+        if not self.process:
+            return
+
+        try:
+            self.__send(("stop",))
+        except (OSError, ValueError):
+            pass
+
+        self.process.join(timeout=5)
+
+        if self.process.is_alive():
+            print("Engine worker did not exit, terminating it")
+            self.process.terminate()
+            self.process.join()
+
+        if self.reader:
+            self.reader.join(timeout=1)
+
+        self.__close_stream()
+        self.conn.close()
+        self.ring.close()
+
+        self.process = None
+        self.conn = None
+        self.ring = None
+        self.reader = None
+
+
+    def __start_worker(self):
+
+        if self.process:
+            self.stop_hotword_detection()
+
+        available = mp_context.Semaphore(0)
+        self.ring = SharedAudioRing(available, size=config.engine_worker_ring_bytes)
+
+        self.conn, child_conn = mp_context.Pipe()
+
+        self.process = mp_context.Process(
+            target=worker_main,
+            args=(
+                child_conn,
+                self.ring.name,
+                available,
+                self.input_dev_index,
+                self.input_dev_sample_rate,
+                self.input_dev_channels),
+            daemon=True)
+
+        self.process.start()
+        child_conn.close()
+
+        self.replies = queue.Queue()
+        self.reader = threading.Thread(target=self.__read_worker, daemon=True)
+        self.reader.start()
+
+
+    def __call(self, method, **kwargs):
+
+        try:
+            self.__send(("call", method, kwargs))
+        except (OSError, ValueError) as e:
+            return False, f"engine worker is not reachable: {e}"
+
+        return self.replies.get()
+
+
+    def __send(self, message):
+
+        with self.send_lock:
+            self.conn.send(message)
+
+
+    def __read_worker(self):
+
+        while True:
+
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            kind = message[0]
+
+            if kind == "result":
+                self.replies.put(message[1])
+
+            elif kind == "event":
+                _, name, payload = message
+                callback = self.callbacks.get(name)
+                if callback:
+                    callback(payload)
+
+            elif kind == "open_audio":
+                _, sample_rate, channels, blocksize = message
+                self.__send(("audio_opened", self.__open_stream(sample_rate, channels, blocksize)))
+
+            elif kind == "close_audio":
+                self.__close_stream()
+
+        self.__close_stream()
+
+        exitcode = self.process.exitcode if self.process else None
+        self.replies.put((False, f"engine worker exited (exit code {exitcode})"))
+
+
+    def __open_stream(self, sample_rate, channels, blocksize):
+
+        self.__close_stream()
+
+        with self.stream_lock:
+            return self.__start_stream(sample_rate, channels, blocksize)
+
+
+    def __start_stream(self, sample_rate, channels, blocksize):
+
+        self.ring.reset()
+
+        def callback(indata, frames, time_info, status):
+
+            if status:
+                print(f"[STATUS] {status}", file=sys.stderr)
+
+            if not self.ring.write(indata, time.monotonic()):
+                print("[WARN] Engine worker ring full — dropping frame")
+
+        try:
+
+            self.stream = sd.RawInputStream(
+                device=self.input_dev_index,
+                samplerate=sample_rate,
+                blocksize=blocksize,
+                dtype='int16',
+                channels=channels,
+                callback=callback)
+
+            self.stream.start()
+
+        except Exception as e:
+            self.stream = None
+            return False, str(e)
+
+        return True, None
+
+
+    def __close_stream(self):
+
+        with self.stream_lock:
+            if self.stream:
+                self.stream.stop()
+                self.stream.close()
+                self.stream = None
+
+
+def worker_main(conn, ring_name, available, dev_index, sample_rate, channels):
+    """
+    Entry point of an engine worker process.
+
+    The main thread executes calls one at a time. A reader thread handles
+    messages that must be served while a call is running: stop requests and
+    replies to audio stream requests.
+    """
+
+    ring = SharedAudioRing(available, name=ring_name)
+
+    send_lock = threading.Lock()
+    calls = queue.Queue()
+    audio_replies = queue.Queue()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def open_stream(stream_rate, stream_channels, blocksize):
+        send(("open_audio", stream_rate, stream_channels, blocksize))
+        return audio_replies.get()
+
+    def close_stream():
+        send(("close_audio",))
+
+    def audio_source(stream_rate, stream_channels, blocksize):
+        return SharedMemorySource(ring, open_stream, close_stream, stream_rate, stream_channels, blocksize)
+
+    # the API process has already checked the STT service health
+    hw_model = HotwordModel(stt_client=create_stt_client(check_health=False, batching=False))
+    hw_model.use_audio_device(dev_index, sample_rate, channels, audio_source)
+
+    def read_parent():
+
+        while True:
+
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ("stop",)
+
+            if message[0] == "stop":
+                hw_model.script_state["interrupted"] = True
+                audio_replies.put((False, "stopped"))
+                calls.put(None)
+                break
+
+            if message[0] == "audio_opened":
+                audio_replies.put(message[1])
+
+            elif message[0] == "want_scores":
+                hw_model.want_scores(message[1])
+
+            elif message[0] == "call":
+                calls.put(message[1:])
+
+    threading.Thread(target=read_parent, daemon=True).start()
+
+    def event(name):
+        return lambda payload: send(("event", name, payload))
+
+    while True:
+
+        call = calls.get()
+        if call is None:
+            break
+
+        method, kwargs = call
+
+        try:
+
+            if method == "init_hotword":
+                keywords = kwargs.pop("keywords")
+                if keywords is not None:
+                    ENGINES[kwargs["model_engine_hotword"]].use_keywords(keywords)
+                result = hw_model.init_hotword(**kwargs)
+
+            elif method == "detect_hotword_and_transcribe":
+                timeline = kwargs.pop("timeline")
+                scores = kwargs.pop("scores")
+                partial = kwargs.pop("partial")
+                latency = kwargs.pop("latency")
+                result = hw_model.detect_hotword_and_transcribe(
+                    on_hotword_callback=event("hotword"),
+                    on_silence_callback=event("silence"),
+                    on_transcription_callback=event("transcription"),
+                    on_timeline_callback=event("timeline") if timeline else None,
+                    on_scores_callback=event("scores") if scores else None,
+                    on_partial_callback=event("partial") if partial else None,
+                    on_latency_callback=event("latency") if latency else None,
+                    on_no_speech_callback=event("no_speech"),
+                    **kwargs)
+
+            else:
+                result = (False, f"unknown call '{method}'")
+
+        except Exception as e:
+            result = (False, str(e))
+
+        send(("result", result))
+
+    if hw_model.model_handler:
+        hw_model.model_handler.stop_hotword_detection()
+
+    ring.close()
+    conn.close()
@@ -0,0 +1,257 @@
+
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import grpc
+    protos, services = grpc.protos_and_services("hotword.proto")
+except (ImportError, NotImplementedError):
+    grpc = None  # needs grpcio and grpcio-tools
+
+import config
+from audio_source import ClientAudioFeed
+from pipeline_manager import Subscriber
+from session_channel import SessionChannel
+from session_params import ListenParams, PIPELINES, host_info, session_spec
+from hotword_types import MessageStatus, MessageType
+
+# ListenParams fields that are only passed on when the client set them
+OPTIONAL_FIELDS = (
+    "target_latency",
+    "adaptive_latency",
+    "silence_duration",
+    "endpointing",
+    "timeline",
+    "scores",
+    "max_recording_duration",
+    "recording_overflow",
+    "engine_execution",
+    "local_stt",
+)
+
+
+def listen_params(request):
+    """
+    ListenParams from the protobuf message of the same name.
+    """
+
+    params = {
+        "dev_index": request.dev_index if request.HasField("dev_index") else None,
+        "dev_indices": list(request.dev_indices) or None,
+        "hotwords": list(request.hotwords),
+        "model_engine_hotword": request.model_engine_hotword,
+        "model_name_hotword": request.model_name_hotword if request.HasField("model_name_hotword") else None,
+        "model_engine_stt": request.model_engine_stt,
+        "model_name_stt": request.model_name_stt if request.HasField("model_name_stt") else None,
+    }
+
+    for name in OPTIONAL_FIELDS:
+        if request.HasField(name):
+            params[name] = getattr(request, name)
+
+    if request.hotword_confidence:
+        params["hotword_confidence"] = {
+            hotword: thresholds.values[0] if len(thresholds.values) == 1 else list(thresholds.values)
+            for hotword, thresholds in request.hotword_confidence.items()
+        }
+
+    if request.events:
+        params["events"] = [MessageType[protos.MessageType.Name(t)] for t in request.events]
+
+    return ListenParams(**params)
+
+
+def listen_event(message):
+    """
+    ListenEvent from a message queued by SessionChannel.
+    """
+
+    event = protos.ListenEvent(
+        status=protos.MessageStatus.Value(MessageStatus(message["status"]).name),
+        type=protos.MessageType.Value(MessageType(message["type"]).name))
+
+    dev_index = message.get("dev_index")
+    if isinstance(dev_index, int):
+        event.dev_index = dev_index
+
+    text = message["text"]
+
+    if isinstance(text, dict):
+        event.data.update(text)
+    else:
+        event.text = text if isinstance(text, str) else json.dumps(text)
+
+    return event
+
+
+class HotwordServicer():
+    """
+    gRPC transport of the WebSocket /listen session.
+
+    Sessions share the PipelineManager, and so the models and device
+    pipelines, of the WebSocket API. Events go through the same bounded
+    SessionChannel, whose sender task waits for gRPC flow control on every
+    write. Audio streamed by the client is fed to a pipeline of its own;
+    while its buffer is full, requests are not read, so the client is held
+    back by flow control as well.
+    """
+
+    def __init__(self, manager, executor):
+
+        self.manager = manager
+        self.executor = executor
+
+        # blocked audio writes wait here, not in the session executor
+        self.feed_executor = ThreadPoolExecutor(max_workers=config.grpc_max_sessions, thread_name_prefix="grpc-feed")
+
+
+    async def Listen(self, request_iterator, context):
+
+        loop = asyncio.get_running_loop()
+        ended = asyncio.Event()
+        subscriber = None
+        feed = None
+
+        request = await context.read()
+        if request is grpc.aio.EOF or request.WhichOneof("request") != "params":
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "The first request must carry the session parameters.")
+
+        try:
+            params = listen_params(request.params)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        print(f"Received parameters from gRPC client: {params.model_dump()}")
+
+        dev_indices, spec, events = session_spec(params)
+
+        if request.params.HasField("audio_format"):
+
+            audio_format = request.params.audio_format
+
+            if audio_format.sample_rate <= 0 or audio_format.channels <= 0:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "audio_format needs a sample rate and channel count.")
+
+            if spec["engine_execution"] != "thread":
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Client audio needs \"engine_execution\": \"thread\".")
+
+            feed = ClientAudioFeed(audio_format.sample_rate, audio_format.channels, config.grpc_audio_buffer_s)
+
+        channel = SessionChannel(
+            None,
+            loop,
+            maxsize=config.session_queue_size,
+            send=lambda message: context.write(listen_event(message)))
+
+        channel.start()
+
+        try:
+
+            channel.post(MessageStatus.OK, MessageType.HOST_INFO, host_info())
+
+            def on_end(dev_index, status, output):
+                if not status:
+                    channel.post(MessageStatus.ERROR, MessageType.NOTIFICATION, output, dev_index)
+                if not self.manager.subscribed_devices(subscriber):
+                    loop.call_soon_threadsafe(ended.set)
+
+            subscriber = Subscriber(channel.post, on_end, events)
+            pipeline_class = PIPELINES[spec["engine_execution"]]
+
+            if feed:
+                subscribe = lambda: self.manager.subscribe_stream(subscriber, feed, spec, pipeline_class)
+            else:
+                subscribe = lambda: self.manager.subscribe(subscriber, dev_indices, spec, pipeline_class)
+
+            status, output = await loop.run_in_executor(self.executor, subscribe)
+
+            if not status:
+                subscriber = None
+                channel.post(
+                    MessageStatus.ERROR,
+                    MessageType.NOTIFICATION,
+                    f"Cannot start hotword detection: {output}")
+                return
+
+            channel.post(
+                MessageStatus.OK,
+                MessageType.NOTIFICATION,
+                "Hotword detection initialized. Listening...")
+
+            # the session ends when the client closes its stream, all its pipelines stop, or a write fails
+            receiver = loop.create_task(self.__receive(context, feed))
+            finished = loop.create_task(ended.wait())
+
+            done, _ = await asyncio.wait(
+                {receiver, finished, channel.task},
+                return_when=asyncio.FIRST_COMPLETED)
+
+            end_of_input = feed and receiver in done and not receiver.exception() and receiver.result()
+
+            if end_of_input and not finished.done():
+                # the pipeline works through the buffered audio and transcribes the last utterance
+                feed.close()
+                await asyncio.wait(
+                    {finished, channel.task},
+                    timeout=config.grpc_end_of_input_timeout_s,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+            for task in (receiver, finished):
+                task.cancel()
+
+            await asyncio.gather(receiver, finished, return_exceptions=True)
+
+        finally:
+            if feed:
+                feed.close()
+            await channel.close()
+            if subscriber:
+                await loop.run_in_executor(self.executor, self.manager.unsubscribe, subscriber)
+
+
+    async def __receive(self, context, feed):
+        """
+        Returns True when the client closed its stream.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+
+            request = await context.read()
+            if request is grpc.aio.EOF:
+                return True
+
+            if feed is None or request.WhichOneof("request") != "audio":
+                continue
+
+            if feed.put(request.audio, block=False):
+                continue
+
+            # the buffer is full: no more requests are read until the engine catches up
+            if not await loop.run_in_executor(self.feed_executor, feed.put, request.audio):
+                return False  # the pipeline has stopped
+
+
+async def start_grpc_server(manager, executor, port):
+    """
+    Serve the gRPC transport on the running event loop. Returns the server,
+    or None when grpc is not installed.
+    """
+
+    if grpc is None:
+        print("gRPC transport is disabled: the 'grpcio' and 'grpcio-tools' packages are not installed")
+        return None
+
+    # without BDP probing the receive window stays small, so an unread stream holds the client back early
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=config.grpc_max_sessions,
+        options=[("grpc.http2.bdp_probe", 0)])
+    services.add_HotwordServicer_to_server(HotwordServicer(manager, executor), server)
+    server.add_insecure_port(f"0.0.0.0:{port}")
+
+    await server.start()
+    print(f"gRPC transport listening on port {port}")
+
+    return server
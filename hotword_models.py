@@ -2,55 +2,134 @@
 import os
 import sys
 import time
+import queue
 import tempfile
 import wave
+import functools
+import threading
+from concurrent.futures import Future
 import webrtcvad
-import sounddevice as sd
 import numpy as np
 from scipy.signal import resample
 
-import utility
 import config
 from speech_to_text_api import STT_REST_API_Client
+from stt_batcher import BatchingSTTClient
+from stt_pool import STTEndpointPool
+from latency_timeline import LatencyTimeline
+from recording_buffer import RecordingBuffer
+from score_stream import ScoreStream
+from latency_controller import LatencyController
+from latency_stats import LatencyWindow
+from endpointer import Endpointer
+from hotword_types import TimelineStage
+from audio_source import MicrophoneSource, FileSource, PrerollTap
+from utterance_archive import get_archive
+from device_inventory import inventory
 
 from engine_vosk import VoskEngine
 from engine_openwakeword import OpenwakewordEngine
 from engine_pvporcupine import PvporcupineEngine
 
-MODELS = {
-    "vosk": VoskEngine(),
-    "openwakeword": OpenwakewordEngine(),
-    "pvporcupine": PvporcupineEngine()
+LOCAL_STT = ("never", "always", "auto")
+
+# text of the Silence message, by what ended the recording
+RECORDING_STOPPED = {
+    "silence": "Silence detected",
+    "max_duration": "Maximum recording duration reached",
+    "interrupted": "Recording interrupted"
+}
+
+ENGINES = {
+    "vosk": VoskEngine,
+    "openwakeword": OpenwakewordEngine,
+    "pvporcupine": PvporcupineEngine
 }
 
 
+def create_stt_client(check_health=True, batching=None):
+
+    urls = config.speech_to_text_urls or [config.speech_to_text_url]
+
+    if len(urls) > 1:
+        stt_client = STTEndpointPool(
+            urls,
+            balancing=config.stt_balancing,
+            eject_failures=config.stt_eject_failures,
+            eject_s=config.stt_eject_s)
+    else:
+        stt_client = STT_REST_API_Client(url=urls[0])
+
+    if check_health and not stt_client.check_health():
+        print("SST service is not reachable")
+        sys.exit(1)
+
+    if config.stt_batching if batching is None else batching:
+        return BatchingSTTClient(
+            stt_client,
+            window_ms=config.stt_batch_window_ms,
+            max_batch=config.stt_batch_max_size,
+            max_inflight=config.stt_batch_max_inflight)
+
+    return stt_client
+
+
+def select_input_device():
+
+    if config.virtual_audio_files:
+        return 0
+
+    return inventory.select_best_microphone()
+
+
 class HotwordModel():
 
-    def __init__(self):
+    # recent remote transcription times, shared by all pipelines of the process
+    remote_latency = LatencyWindow(config.local_stt_window_s)
 
-        self.stt_client = STT_REST_API_Client(url=config.speech_to_text_url)
+    # STT model loads in flight, shared by all pipelines of the process: (engine, model) -> Future
+    stt_loads = {}
+    stt_loads_lock = threading.Lock()
 
-        if not self.stt_client.check_health():
-            print("SST service is not reachable")
-            sys.exit(1)
+    def __init__(self, stt_client=None):
+
+        self.stt_client = stt_client or create_stt_client()
 
         self.input_dev_index = None
         self.input_dev_sample_rate = None
         self.input_dev_channels = None
+        self.audio_source = None
 
         self.model_handler = None
+        self.model_engine_stt = None
+        self.model_name_stt = None
+        self.local_stt = "never"
         self.script_state = {"interrupted": False}
 
+        # whether anyone receives per-keyword scores and partial transcripts right now
+        self.scores_wanted = True
+
         self.vad = webrtcvad.Vad(3)
         self.target_rate = 16000
 
+        # audio before each detection is kept for the utterance archive, when one is configured
+        self.archive = get_archive()
+        self.preroll = None
+        self.recording = None
+
+        # recordings sent for transcription and those skipped because they held no speech
+        self.stt_stats = {"transcribed": 0, "no_speech": 0, "local": 0}
+
 
     def init_audio_device(
         self,
         dev_index=None,
         dev_input_callback=None):
 
-        dev_info_default = utility.get_default_input_device()
+        if config.virtual_audio_files:
+            return self.__init_virtual_device(dev_index, dev_input_callback)
+
+        dev_info_default = inventory.get_default_input_device()
 
         if dev_info_default:
 
@@ -61,15 +140,13 @@ class HotwordModel():
                 f"(hostapi: {dev_info_default['hostapi_name']})"
             )
 
-        if not dev_index:
+        if dev_index is None:
 
-            mic_only, _, input_output = utility.get_audio_devices()
-
-            dev_index = utility.select_best_microphone(mic_only, input_output)
+            dev_index = select_input_device()
             if dev_index is None:
                 return False, "__init_input_device: No suitable input device found."
 
-        dev_info = utility.get_device_info(dev_index)
+        dev_info = inventory.get_device_info(dev_index)
         if not dev_info:
             return False, f"Cannot obtain device info with index {dev_index}."
 
@@ -78,25 +155,113 @@ class HotwordModel():
         if dev_input_callback:
             dev_input_callback(dev_info)
 
-        self.input_dev_index = dev_index
-        self.input_dev_sample_rate = int(dev_info["rate"])
-        self.input_dev_channels = dev_info["in_ch"]
+        self.use_audio_device(dev_index, int(dev_info["rate"]), dev_info["in_ch"])
+
+        return True, None
+
+
+    def __init_virtual_device(self, dev_index=None, dev_input_callback=None):
+
+        dev_index = dev_index or 0
+        path = config.virtual_audio_files[dev_index % len(config.virtual_audio_files)]
+
+        try:
+            with wave.open(path, "rb") as wf:
+                sample_rate = wf.getframerate()
+        except Exception as e:
+            return False, f"Cannot open virtual audio file '{path}': {e}"
+
+        dev_info = {
+            "index": dev_index,
+            "name": f"virtual: {os.path.basename(path)}",
+            "hostapi_name": "virtual",
+            "in_ch": 1,
+            "out_ch": 0,
+            "rate": sample_rate,
+            "lat_in_low": 0.0,
+            "lat_in_high": 0.0,
+            "lat_out_low": 0.0,
+            "lat_out_high": 0.0,
+        }
+
+        print(f'\nUsing virtual input device: [{dev_index}] {path}')
+
+        if dev_input_callback:
+            dev_input_callback(dev_info)
+
+        self.use_audio_device(dev_index, sample_rate, 1, functools.partial(FileSource, path))
+
+        return True, None
+
+
+    def init_audio_stream(self, feed, dev_input_callback=None):
+        """
+        Use audio streamed by the client (an audio_source.ClientAudioFeed)
+        instead of a capture device.
+        """
+
+        dev_info = {
+            "index": feed.name,
+            "name": f"client stream: {feed.name}",
+            "hostapi_name": "client",
+            "in_ch": feed.channels,
+            "out_ch": 0,
+            "rate": feed.sample_rate,
+            "lat_in_low": 0.0,
+            "lat_in_high": 0.0,
+            "lat_out_low": 0.0,
+            "lat_out_high": 0.0,
+        }
+
+        print(f'\nUsing client audio stream: {feed.name} ({feed.sample_rate} Hz, {feed.channels} ch)')
+
+        if dev_input_callback:
+            dev_input_callback(dev_info)
+
+        # at the end of the client's audio, an utterance in progress is still transcribed
+        feed.on_drained = self.interrupt
+
+        self.use_audio_device(feed.name, feed.sample_rate, feed.channels, feed)
 
         return True, None
 
 
+    def use_audio_device(self, dev_index, sample_rate, channels, audio_source=None):
+        """
+        Bind an already selected device. audio_source is a callable
+        (sample_rate, channels, blocksize) returning the context manager that
+        delivers audio blocks; it defaults to capturing from the device.
+        """
+
+        self.input_dev_index = dev_index
+        self.input_dev_sample_rate = sample_rate
+        self.input_dev_channels = channels
+        self.audio_source = audio_source or functools.partial(MicrophoneSource, dev_index)
+
+        if self.archive:
+            self.preroll = PrerollTap(self.audio_source, config.archive_preroll_s)
+            self.audio_source = self.preroll
+
+
     def init_hotword(
         self,
         model_engine_hotword="vosq",
         model_name_hotword="vosk-model-en-us-0.22",
         model_engine_stt="openai_whisper",
-        model_name_stt="small.en"):
+        model_name_stt="small.en",
+        local_stt="never",
+        load_stt=True):
+
+        if local_stt not in LOCAL_STT:
+            return False, f"Unknown local_stt '{local_stt}'. Choose from {list(LOCAL_STT)}"
+
+        self.local_stt = local_stt
 
         status, output = self.__init_engine_hotword(model_engine_hotword, model_name_hotword)
         if not status:
             return False, output
 
-        status, output = self.__init_engine_stt(model_engine_stt, model_name_stt)
+        status, output = self.__init_engine_stt(model_engine_stt, model_name_stt, load_stt)
         if not status:
             return False, output
 
@@ -105,45 +270,123 @@ class HotwordModel():
 
     def __init_engine_hotword(self, model_engine_hotword, model_name_hotword):
 
-        if model_engine_hotword not in MODELS:
+        if model_engine_hotword not in ENGINES:
             return False, f"Engine '{model_engine_hotword}' not supported"
 
-        self.model_handler = MODELS[model_engine_hotword]
+        # each pipeline gets its own engine instance, heavy models are shared by the engine class
+        self.model_handler = ENGINES[model_engine_hotword]()
 
         try:
             return self.model_handler.init_model(
                 model_name_hotword,
                 self.input_dev_index,
                 self.input_dev_sample_rate,
-                self.input_dev_channels)
+                self.input_dev_channels,
+                self.audio_source)
         except Exception as e:
             return False, f"Failed to init model: {str(e)}"
 
 
-    def __init_engine_stt(self, model_engine_stt, model_name_stt):
+    def __init_engine_stt(self, model_engine_stt, model_name_stt, load=True):
+
+        if load:
+            status, output = self.load_stt_model(model_engine_stt, model_name_stt)
+            if not status:
+                return False, output
+
+        # recordings of this pipeline are transcribed with the model its sessions asked for
+        self.model_engine_stt = model_engine_stt
+        self.model_name_stt = model_name_stt
+
+        return True, None
+
+
+    def resources(self):
+        """
+        Memory held for this pipeline: the engine's model (RSS growth measured
+        while it loaded) and the current recording buffer.
+        """
+
+        recording = self.recording
+        engine = self.model_handler.resources() if self.model_handler else {}
+
+        return {
+            "engine": type(self.model_handler).__name__ if self.model_handler else None,
+            **engine,
+            "recording_bytes": len(recording["buffer"].buffer) if recording else 0
+        }
+
+
+    def load_stt_model(self, model_engine_stt, model_name_stt):
+        """
+        Make sure the STT service has the model loaded. Concurrent requests
+        for the same model share one load, and a model that the service
+        reports as loaded is not loaded again. Finished loads are not
+        remembered, since the service may restart or evict the model.
+        """
+
+        key = (model_engine_stt, model_name_stt)
+
+        with HotwordModel.stt_loads_lock:
+            future = HotwordModel.stt_loads.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                HotwordModel.stt_loads[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self.__request_stt_model(model_engine_stt, model_name_stt)
+        except Exception as e:
+            result = (False, str(e))
+        finally:
+            with HotwordModel.stt_loads_lock:
+                del HotwordModel.stt_loads[key]
+
+        future.set_result(result)
+
+        return result
+
+
+    def __request_stt_model(self, model_engine_stt, model_name_stt):
+
+        loaded_models = getattr(self.stt_client, "loaded_models", None)
+
+        if loaded_models:
+            status, output = loaded_models()
+            if status and {"engine": model_engine_stt, "model_name": model_name_stt} in output.get("models", []):
+                print(f"{model_engine_stt} model '{model_name_stt}' is already loaded")
+                return True, None
 
         print(f"\n🔄 Loading {model_engine_stt} model '{model_name_stt}'...")
 
         return self.stt_client.load_model(model_engine_stt, model_name_stt)
 
 
-    def stop_hotword_detection(self):
-
-        print("Stopping hotword detection...")
+    def interrupt(self):
 
         self.script_state["interrupted"] = True
 
-        try:
 
-            # wait for loops to terminate
-            time.sleep(3)
+    def want_scores(self, wanted):
+        """
+        Engines skip computing scores and partial transcripts while nobody receives them.
+        """
 
-            if self.model_handler:
-                self.model_handler.stop_hotword_detection()
+        self.scores_wanted = wanted
 
-        finally:
 
-            self.script_state["interrupted"] = False
+    def stop_hotword_detection(self):
+
+        print("Stopping hotword detection...")
+
+        # stays set, so a detection loop that outlived its pipeline's join still ends
+        self.script_state["interrupted"] = True
+
+        if self.model_handler:
+            self.model_handler.stop_hotword_detection()
 
 
     def detect_hotword_and_transcribe(
@@ -153,89 +396,274 @@ class HotwordModel():
         on_silence_callback=None,
         on_transcription_callback=None,
         target_latency_ms=100,
-        silence_duration_s=3):
+        silence_duration_s=3,
+        on_timeline_callback=None,
+        max_recording_s=30,
+        recording_overflow="cut",
+        hotword_confidence=None,
+        on_scores_callback=None,
+        on_partial_callback=None,
+        adaptive_latency=False,
+        on_latency_callback=None,
+        endpointing="fixed",
+        on_no_speech_callback=None):
 
         if self.input_dev_index is None or self.model_handler is None:
             return False, "hotword detection is not initialized!"
 
+        self.script_state["interrupted"] = False
+
         hotword_list = [x.lower() for x in hotword_list]
 
+        if hotword_confidence:
+            hotword_confidence = {k.lower(): v for k, v in hotword_confidence.items()}
+
+        timeline = LatencyTimeline() if on_timeline_callback else None
+
+        latency = LatencyController(
+            target_latency_ms,
+            adaptive=adaptive_latency,
+            min_latency_ms=config.adaptive_latency_min_ms,
+            max_latency_ms=config.adaptive_latency_max_ms,
+            on_change=on_latency_callback)
+
+        score_stream = None
+        if on_scores_callback or on_partial_callback:
+            score_stream = ScoreStream(
+                config.score_stream_rate,
+                config.score_stream_aggregate,
+                on_scores_callback,
+                on_partial_callback,
+                wanted=lambda: self.scores_wanted)
+
+        detected = []
+
+        def on_hotword(hotword):
+            detected.append(hotword)
+            if on_hotword_callback:
+                on_hotword_callback(hotword)
+
         while not self.script_state["interrupted"]:
 
             print(f"\nListening for hotwords '{hotword_list}'...")
 
+            if timeline:
+                timeline.start()
+
+            detected.clear()
+
             # blocking call until hotword is detected
             status, output = self.model_handler.start_hotword_detection(
                 hotword_list,
                 target_latency_ms,
                 self.script_state,
-                on_hotword_callback)
+                on_hotword if self.archive else on_hotword_callback,
+                timeline,
+                hotword_confidence,
+                score_stream,
+                latency)
 
             if not status:
                 return False, output
 
             if not self.script_state["interrupted"]:
 
-                callback, audio_frames = self.__record_callback(silence_duration=silence_duration_s)
+                on_audio, recording = self.__record_handler(
+                    silence_duration=silence_duration_s,
+                    max_duration=max_recording_s,
+                    overflow=recording_overflow,
+                    endpointing=endpointing)
+
+                self.recording = recording
+
+                if self.archive:
+                    recording["hotwords"] = list(detected)
+                    recording["preroll"] = self.preroll.snapshot()
 
-                blocksize = utility.choose_blocksize(
-                    target_latency_ms,
-                    self.input_dev_sample_rate)
+                blocksize = latency.blocksize(
+                    self.input_dev_sample_rate,
+                    self.input_dev_channels)
 
-                with sd.RawInputStream(
-                    device=self.input_dev_index,
-                    samplerate=self.input_dev_sample_rate,
-                    blocksize=blocksize,
-                    dtype='int16',
-                    channels=self.input_dev_channels,
-                    callback=callback) as stream:
+                with self.audio_source(
+                    self.input_dev_sample_rate,
+                    self.input_dev_channels,
+                    blocksize) as source:
 
                     print("Recording started...")
-                    while stream.active:
-                        sd.sleep(20)
+                    if timeline:
+                        timeline.mark(TimelineStage.RECORDING_STARTED)
+
+                    while not self.script_state["interrupted"]:
+
+                        item = source.read(timeout=0.02)
+                        if item is not None and not on_audio(item[1]):
+                            break
+
+                        # segments of over-long recordings are transcribed while recording continues
+                        status, output = self.__transcribe_segments(recording, on_transcription_callback, timeline, on_no_speech_callback)
+                        if not status:
+                            return False, output
+
+                if timeline:
+                    timeline.mark(TimelineStage.SILENCE_DETECTED)
+
+                stopped_by = recording["stopped_by"] or "interrupted"
 
                 if on_silence_callback:
-                    on_silence_callback("Silence detected")
+                    on_silence_callback(RECORDING_STOPPED[stopped_by])
+
+                print(f"Recording stopped: {RECORDING_STOPPED[stopped_by]}")
+
+                recording["segments"].put(recording["buffer"])
 
-                if audio_frames:
-                    status, output = self.__recording_done_callback(audio_frames)
-                    if not status:
-                        return False, output
-                    elif on_transcription_callback:
-                        on_transcription_callback(output)
+                status, output = self.__transcribe_segments(recording, on_transcription_callback, timeline, on_no_speech_callback)
+                if not status:
+                    return False, output
+
+                self.recording = None
+
+                if timeline:
+                    on_timeline_callback(timeline.to_dict())
 
         return True, None
 
 
-    def __record_callback(self, frame_duration_ms=30, silence_duration=3):
+    def __record_handler(self, frame_duration_ms=30, silence_duration=3, max_duration=30, overflow="cut", endpointing="fixed"):
 
         frame_size = int(self.input_dev_sample_rate * frame_duration_ms / 1000) * 2  # in bytes
 
+        def new_buffer():
+            return RecordingBuffer(
+                self.input_dev_sample_rate,
+                self.input_dev_channels,
+                max_duration_s=max_duration,
+                max_bytes=config.recording_max_bytes)
+
         buffer = bytearray()
-        audio_frames = []
-        silence_start = None
+        recording = {
+            "buffer": new_buffer(),
+            "segments": queue.SimpleQueue(),
+            "stopped_by": None
+        }
+        endpoint = Endpointer(
+            silence_duration,
+            mode=endpointing,
+            min_silence_ms=config.endpointing_min_silence_ms,
+            silence_per_speech=config.endpointing_silence_per_speech,
+            noisy_floor_dbfs=config.endpointing_noisy_floor_dbfs)
+
+        def on_audio(data):
+            """
+            Consume one audio block. Returns False once recording should stop.
+            """
+
+            data = memoryview(data).cast("B")
+            buffer.extend(data)
+
+            written = recording["buffer"].append(data)
+
+            if written < len(data):
+
+                if overflow != "split":
+                    print(f"Recording reached the maximum length of {max_duration}s")
+                    recording["stopped_by"] = "max_duration"
+                    return False
+
+                # hand the full segment over and keep recording into a fresh buffer
+                recording["segments"].put(recording["buffer"])
+                recording["buffer"] = new_buffer()
+                recording["buffer"].append(data[written:])
 
-        def callback(indata, frames, time_info, status):
+            while not self.script_state["interrupted"] and len(buffer) >= frame_size:
+                frame_bytes = bytes(buffer[:frame_size])
+                del buffer[:frame_size]
 
-            nonlocal buffer, silence_start, audio_frames
+                # silence is measured in audio time, independent of processing delays
+                is_speech = not self.__is_silence(frame_bytes, self.input_dev_sample_rate, frame_duration_ms)
+                frame_dbfs = None if is_speech else Endpointer.dbfs(np.frombuffer(frame_bytes, dtype=np.int16))
 
-            pcm = bytes(indata)
-            buffer.extend(pcm)
-            audio_frames.append(pcm)
+                # the frame just ended where the still unprocessed bytes begin
+                frame_end = len(recording["buffer"]) - len(buffer)
+                recording["buffer"].add_vad(is_speech, frame_duration_ms, frame_end - frame_size, frame_end)
 
-            while not self.script_state["interrupted"] and len(buffer) >= frame_size:
-                frame_bytes = bytes(buffer[:frame_size])
-                buffer = buffer[frame_size:]
+                if endpoint.update(is_speech, frame_duration_ms, frame_dbfs):
+                    recording["stopped_by"] = "silence"
+                    return False
+
+            return True
+
+        return on_audio, recording
+
+
+    def __transcribe_segments(self, recording, on_transcription_callback=None, timeline=None, on_no_speech_callback=None):
+
+        while not recording["segments"].empty():
+
+            segment = recording["segments"].get_nowait()
+            if not len(segment):
+                continue
+
+            # false wakes followed by silence do not cost a transcription
+            if not self.__has_speech(segment):
+
+                if self.archive:
+                    self.__archive(recording, segment, None, timeline)
+
+                self.stt_stats["no_speech"] += 1
+                print(f"No speech in recording, transcription skipped ({self.stt_stats['no_speech']} so far)")
+
+                if on_no_speech_callback:
+                    on_no_speech_callback({
+                        "duration_s": round(segment.duration(), 3),
+                        "voiced_ms": segment.voiced_ms,
+                        "voiced_ratio": round(segment.voiced_ratio(), 3),
+                        **self.stt_stats
+                    })
+
+                continue
+
+            status, output = self.__recording_done_callback(segment, timeline)
+            if not status:
+                return False, output
+
+            self.stt_stats["transcribed"] += 1
+
+            if self.archive:
+                self.__archive(recording, segment, output, timeline)
+
+            if on_transcription_callback:
+                on_transcription_callback(output)
+
+        return True, None
+
+
+    def __archive(self, recording, segment, transcript, timeline=None):
+
+        # the audio before the detection belongs to the first segment only
+        preroll = recording.pop("preroll", None)
+
+        metadata = {
+            "dev_index": self.input_dev_index,
+            "hotwords": recording.get("hotwords", []),
+            "transcript": transcript,
+            "no_speech": transcript is None,
+            "model_engine_stt": self.model_engine_stt,
+            "model_name_stt": self.model_name_stt,
+            "recording_s": round(segment.duration(), 3),
+            "voiced_ms": segment.voiced_ms,
+            "timeline": timeline.to_dict() if timeline else None
+        }
+
+        if not self.archive.submit(segment.view(), segment.sample_rate, segment.channels, metadata, preroll):
+            print("[WARN] Utterance archive is busy — utterance not archived")
 
-                if self.__is_silence(frame_bytes, self.input_dev_sample_rate, frame_duration_ms):
-                    if silence_start is None:
-                        silence_start = time.time()
-                    elif time.time() - silence_start > silence_duration:
-                        raise sd.CallbackStop()
-                else:
-                    silence_start = None
 
-        return callback, audio_frames
+    def __has_speech(self, segment):
+
+        return (
+            segment.voiced_ms >= config.no_speech_min_voiced_ms and
+            segment.voiced_ratio() >= config.no_speech_min_voiced_ratio
+        )
 
 
     def __is_silence(self, pcm_bytes, original_rate, frame_duration_ms):
@@ -259,9 +687,67 @@ class HotwordModel():
         return not self.vad.is_speech(resampled_bytes, self.target_rate)
 
 
-    def __recording_done_callback(self, audio_frames):
+    def __recording_done_callback(self, recording, timeline=None):
+
+        # leading dead air and the trailing silence that ended the recording are not transcribed
+        audio = recording.voiced_view(config.recording_trim_guard_ms)
+        duration = len(audio) / (recording.sample_rate * recording.channels * recording.sample_width)
+
+        local = self.__local_transcriber(duration)
+
+        if local and self.__prefer_local():
+            return self.__transcribe_local(local, audio, recording.sample_rate, timeline)
+
+        status, output = self.__transcribe_remote(audio, recording, timeline)
+
+        if not status and local and self.local_stt == "auto":
+            print(f"Remote transcription failed, transcribing locally: {output}")
+            return self.__transcribe_local(local, audio, recording.sample_rate, timeline)
+
+        return status, output
+
+
+    def __local_transcriber(self, duration):
+
+        if self.local_stt == "never" or duration > config.local_stt_max_duration_s:
+            return None
 
-        print("Recording stopped due to silence")
+        # only engines that hold a full speech model (Vosk) can transcribe
+        return getattr(self.model_handler, "transcribe", None)
+
+
+    def __prefer_local(self):
+
+        if self.local_stt == "always":
+            return True
+
+        p95 = HotwordModel.remote_latency.percentile(95)
+
+        return p95 is not None and p95 * 1000 > config.local_stt_budget_ms
+
+
+    def __transcribe_local(self, transcribe, audio, sample_rate, timeline=None):
+
+        print("Transcribing audio locally...")
+
+        if timeline:
+            timeline.mark(TimelineStage.UPLOAD_STARTED)
+
+        try:
+            status, output = transcribe(audio, sample_rate)
+        except Exception as e:
+            status, output = False, str(e)
+
+        if timeline:
+            timeline.mark(TimelineStage.TRANSCRIPT_RECEIVED)
+
+        if status:
+            self.stt_stats["local"] += 1
+
+        return status, output
+
+
+    def __transcribe_remote(self, audio, recording, timeline=None):
 
         temp_file = None
 
@@ -270,16 +756,27 @@ class HotwordModel():
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
 
             with wave.open(temp_file, 'wb') as wf:
-                wf.setnchannels(self.input_dev_channels)
-                wf.setsampwidth(2)  # 16-bit = 2 bytes
-                wf.setframerate(self.input_dev_sample_rate)
-                wf.writeframes(b''.join(audio_frames))
+                wf.setnchannels(recording.channels)
+                wf.setsampwidth(recording.sample_width)
+                wf.setframerate(recording.sample_rate)
+                wf.writeframes(audio)
 
             temp_file.close()
 
             print("Sending audio to backend for transcription...")
 
-            status, output = self.stt_client.transcribe_file(temp_file.name, "openai_whisper", "small.en")
+            if timeline:
+                timeline.mark(TimelineStage.UPLOAD_STARTED)
+
+            started = time.monotonic()
+            status, output = self.stt_client.transcribe_file(temp_file.name, self.model_engine_stt, self.model_name_stt)
+
+            # a failed request counts as infinitely slow, so "auto" goes local while the service is down
+            HotwordModel.remote_latency.add(time.monotonic() - started if status else float("inf"))
+
+            if timeline:
+                timeline.mark(TimelineStage.TRANSCRIPT_RECEIVED)
+
             if not status:
                 return False, output
 
@@ -14,3 +14,18 @@ class MessageType(str, Enum):
     HOTWORD = "Hotword"
     SILENCE = "Silence"
     TRANSCRIBED = "Transcribed"
+    TIMELINE = "Timeline"
+    SCORES = "Scores"
+    PARTIAL = "Partial"
+    LATENCY = "Latency"
+    NO_SPEECH = "No Speech"
+
+
+class TimelineStage(str, Enum):
+    AUDIO_CAPTURED = "audio_captured"
+    HOTWORD_SCORED = "hotword_scored"
+    HOTWORD_FIRED = "hotword_fired"
+    RECORDING_STARTED = "recording_started"
+    SILENCE_DETECTED = "silence_detected"
+    UPLOAD_STARTED = "upload_started"
+    TRANSCRIPT_RECEIVED = "transcript_received"
@@ -0,0 +1,246 @@
+
+import os
+import re
+import json
+import time
+import threading
+
+PORCUPINE_SUFFIX = re.compile(r"_[a-z]{2}_[a-z0-9]+_v\d+(_\d+)*$")
+
+
+class KeywordIndex():
+    """
+    Index of the custom keyword models in a directory.
+
+    Every file with one of the given extensions becomes a keyword. Its name
+    comes from the optional manifest (keywords.json, mapping file names to
+    keyword names) or else from the file name. A background thread rescans
+    the directory every poll_s seconds. New or changed files are validated
+    and preloaded before they are offered, so sessions never wait for them,
+    and a model that fails validation is reported instead of being offered.
+    Models found but not validated yet are listed as pending.
+    """
+
+    MANIFEST = "keywords.json"
+
+    def __init__(self, directory, extensions, validate=None, poll_s=5):
+
+        self.directory = directory
+        self.extensions = tuple(extensions)
+        self.validate = validate
+        self.poll_s = poll_s
+
+        self.lock = threading.Lock()
+        self.entries = {}  # file name -> entry
+        self.listed = threading.Event()
+
+        self.thread = threading.Thread(target=self.__watch, daemon=True)
+        self.thread.start()
+
+
+    def paths(self, timeout=10):
+        """
+        Keyword name -> model path of every validated model.
+        """
+
+        self.listed.wait(timeout)
+
+        with self.lock:
+            return {
+                entry["keyword"]: entry["path"]
+                for entry in self.entries.values()
+                if entry["status"] == "ready"
+            }
+
+
+    def pending(self, timeout=10):
+        """
+        Keyword names of the models that are still being validated.
+        """
+
+        self.listed.wait(timeout)
+
+        with self.lock:
+            return [entry["keyword"] for entry in self.entries.values() if entry["status"] == "pending"]
+
+
+    def snapshot(self):
+        """
+        The current keywords, for a process that should not validate them again.
+        """
+
+        return KeywordSnapshot(self.paths(), self.pending())
+
+
+    def report(self):
+
+        with self.lock:
+            return [
+                {k: v for k, v in entry.items() if k != "mtime"}
+                for _, entry in sorted(self.entries.items())
+            ]
+
+
+    def __watch(self):
+
+        while True:
+
+            try:
+                self.__scan()
+            except Exception as e:
+                print(f"❌ Failed to scan keyword models in {self.directory}: {e}")
+
+            self.listed.set()
+
+            if not self.poll_s:
+                break
+
+            time.sleep(self.poll_s)
+
+
+    def __scan(self):
+
+        manifest = self.__read_manifest()
+
+        found = {}
+
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(self.extensions):
+                        found[entry.name] = entry.stat()
+
+        changed = []
+
+        with self.lock:
+
+            for file_name in list(self.entries):
+                if file_name not in found:
+                    print(f"Keyword model removed: {file_name}")
+                    del self.entries[file_name]
+
+            for file_name, stat in found.items():
+
+                keyword = manifest.get(file_name) or self.keyword_from_file(file_name)
+
+                entry = self.entries.get(file_name)
+                unchanged = (
+                    entry is not None and
+                    entry["mtime"] == stat.st_mtime_ns and
+                    entry["size"] == stat.st_size
+                )
+                if unchanged:
+                    entry["keyword"] = keyword
+                    continue
+
+                self.entries[file_name] = {
+                    "keyword": keyword,
+                    "file": file_name,
+                    "path": os.path.join(self.directory, file_name),
+                    "size": stat.st_size,
+                    "mtime": None,  # validated on the next scan if this one fails
+                    "status": "pending",
+                    "error": None
+                }
+                changed.append((file_name, keyword, stat))
+
+        # sessions see the pending models while they are validated
+        self.listed.set()
+
+        for file_name, keyword, stat in changed:
+
+            path = os.path.join(self.directory, file_name)
+            status, error = self.__load(path)
+
+            with self.lock:
+                self.entries[file_name] = {
+                    "keyword": keyword,
+                    "file": file_name,
+                    "path": path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "status": "ready" if status else "invalid",
+                    "error": error
+                }
+
+            if status:
+                print(f"Keyword model ready: '{keyword}' ({file_name})")
+            else:
+                print(f"❌ Keyword model '{file_name}' is invalid: {error}")
+
+
+    def __load(self, path):
+
+        try:
+
+            # warm the page cache, so the first session does not read the file from disk
+            with open(path, "rb") as f:
+                while f.read(1024 * 1024):
+                    pass
+
+            if self.validate:
+                return self.validate(path)
+
+        except Exception as e:
+            return False, str(e)
+
+        return True, None
+
+
+    def __read_manifest(self):
+
+        path = os.path.join(self.directory, self.MANIFEST)
+
+        if not os.path.isfile(path):
+            return {}
+
+        try:
+            with open(path) as f:
+                return {k: v.lower() for k, v in json.load(f).items()}
+        except Exception as e:
+            print(f"❌ Invalid keyword manifest {path}: {e}")
+            return {}
+
+
+    @staticmethod
+    def keyword_from_file(file_name):
+        """
+        'hey-agent_en_linux_v3_0_0.ppn' -> 'hey agent', 'hey_agent.tflite' -> 'hey agent'
+        """
+
+        stem = os.path.splitext(file_name)[0]
+
+        # Porcupine appends language, platform and version to the keyword
+        stem = PORCUPINE_SUFFIX.sub("", stem)
+
+        return stem.replace("-", " ").replace("_", " ").strip().lower()
+
+
+class KeywordSnapshot():
+    """
+    Keywords validated by the KeywordIndex of another process, handed to
+    engine workers so they do not scan and validate the models again.
+    """
+
+    def __init__(self, paths, pending=()):
+
+        self.keyword_paths = dict(paths)
+        self.pending_keywords = list(pending)
+
+
+    def paths(self, timeout=None):
+
+        return dict(self.keyword_paths)
+
+
+    def pending(self, timeout=None):
+
+        return list(self.pending_keywords)
+
+
+    def report(self):
+
+        return [
+            {"keyword": keyword, "path": path, "status": "ready"}
+            for keyword, path in sorted(self.keyword_paths.items())
+        ]
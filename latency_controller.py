@@ -0,0 +1,168 @@
+
+import utility
+
+
+class LatencyController():
+    """
+    Chooses the capture block size and the processing batch of a pipeline.
+
+    With adaptive=False it reproduces the fixed block size derived from the
+    target latency. With adaptive=True it watches the source queue depth,
+    callback overruns and the time spent processing each step. Under load it
+    first merges more queued blocks per processing step and grows the block
+    size used for the next stream; when the pipeline is idle it shrinks them
+    again, always within [min_latency_ms, max_latency_ms].
+    """
+
+    def __init__(
+        self,
+        target_latency_ms=100,
+        adaptive=False,
+        min_latency_ms=30,
+        max_latency_ms=500,
+        on_change=None,
+        high_water=2,
+        calm_steps=50,
+        cooldown_steps=10):
+
+        self.adaptive = adaptive
+        self.min_latency_ms = min(min_latency_ms, target_latency_ms)
+        self.max_latency_ms = max(max_latency_ms, target_latency_ms)
+        self.on_change = on_change
+
+        self.high_water = high_water
+        self.calm_steps = calm_steps
+        self.cooldown_steps = cooldown_steps
+
+        self.latency_ms = target_latency_ms  # block duration of the next stream
+        self.block_ms = target_latency_ms    # block duration of the current stream
+        self.batch = 1
+
+        self.bytes_per_second = None
+        self.last_audio_s = 0.0
+        self.load = 0.0
+        self.pending = 0
+        self.last_overruns = 0
+        self.calm = 0
+        self.cooldown = 0
+
+
+    def blocksize(self, sample_rate, channels=1, fixed=None):
+        """
+        Block size (in frames) for a stream that is about to be opened.
+        Engines that need a fixed frame length pass it as 'fixed' and are
+        only adapted through the processing batch.
+        """
+
+        if fixed:
+            self.block_ms = fixed * 1000 / sample_rate
+        else:
+            self.block_ms = self.latency_ms
+
+        self.bytes_per_second = sample_rate * channels * 2
+        self.last_overruns = 0
+
+        if self.batch * self.block_ms > self.max_latency_ms:
+            self.batch = max(1, int(self.max_latency_ms // self.block_ms))
+
+        return fixed or utility.choose_blocksize(self.block_ms, sample_rate)
+
+
+    def read(self, source, timeout=None):
+        """
+        Read one block, merged with up to batch - 1 blocks that are already queued.
+        """
+
+        item = source.read(timeout)
+
+        if item is not None and self.batch > 1:
+
+            captured_at, data = item
+            chunks = [data]
+
+            for _ in range(self.batch - 1):
+                queued = source.read(0)
+                if queued is None:
+                    break
+                captured_at, data = queued
+                chunks.append(data)
+
+            item = (captured_at, b"".join(chunks))
+
+        if item is not None and self.bytes_per_second:
+            self.last_audio_s = len(item[1]) / self.bytes_per_second
+
+        return item
+
+
+    def observe(self, source, processing_s):
+        """
+        Record the processing time of the last read and adapt if needed.
+        """
+
+        if not self.adaptive or not self.last_audio_s:
+            return
+
+        self.load = 0.8 * self.load + 0.2 * (processing_s / self.last_audio_s)
+        self.pending = source.pending()
+
+        overruns = source.overruns()
+        new_overruns = overruns - self.last_overruns
+        self.last_overruns = overruns
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+
+        if new_overruns > 0 or self.pending > self.high_water or self.load > 0.8:
+            self.calm = 0
+            self.__adjust(increase=True)
+
+        elif self.pending == 0 and self.load < 0.3:
+            self.calm += 1
+            if self.calm >= self.calm_steps:
+                self.calm = 0
+                self.__adjust(increase=False)
+
+        else:
+            self.calm = 0
+
+
+    def effective_latency_ms(self):
+
+        return self.block_ms * self.batch
+
+
+    def report(self):
+
+        return {
+            "effective_latency_ms": round(self.effective_latency_ms(), 1),
+            "block_ms": round(self.block_ms, 1),
+            "next_block_ms": self.latency_ms,
+            "batch": self.batch,
+            "load": round(self.load, 3),
+            "pending": self.pending,
+            "overruns": self.last_overruns
+        }
+
+
+    def __adjust(self, increase):
+
+        before = (self.latency_ms, self.batch)
+
+        if increase:
+            if (self.batch + 1) * self.block_ms <= self.max_latency_ms:
+                self.batch += 1
+            self.latency_ms = min(self.max_latency_ms, int(self.latency_ms * 1.5))
+        else:
+            if self.batch > 1:
+                self.batch -= 1
+            self.latency_ms = max(self.min_latency_ms, int(self.latency_ms / 1.5))
+
+        if (self.latency_ms, self.batch) == before:
+            return
+
+        self.cooldown = self.cooldown_steps
+
+        if self.on_change:
+            self.on_change(self.report())
@@ -0,0 +1,57 @@
+
+import time
+import math
+import threading
+import collections
+
+
+class LatencyWindow():
+    """
+    Durations observed during the last window_s seconds, with percentiles.
+
+    Old samples expire, so a slow or failed period stops counting once it
+    is over. At most maxlen samples are kept (None for no limit). Safe to
+    use from several threads.
+    """
+
+    def __init__(self, window_s=60, maxlen=1000):
+
+        self.window_s = window_s
+        self.samples = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+
+    def add(self, duration_s):
+
+        with self.lock:
+            self.samples.append((time.monotonic(), duration_s))
+
+
+    def percentile(self, q):
+        """
+        q-th percentile (nearest rank) of the recent durations, or None without samples.
+        """
+
+        with self.lock:
+            self.__expire()
+            durations = sorted(duration for _, duration in self.samples)
+
+        if not durations:
+            return None
+
+        rank = max(math.ceil(q / 100 * len(durations)), 1)
+        return durations[rank - 1]
+
+
+    def __len__(self):
+
+        with self.lock:
+            self.__expire()
+            return len(self.samples)
+
+
+    def __expire(self):
+
+        cutoff = time.monotonic() - self.window_s
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
@@ -0,0 +1,44 @@
+
+import time
+
+from hotword_types import TimelineStage
+
+
+class LatencyTimeline():
+    """
+    Collects monotonic timestamps for each stage boundary of one utterance.
+
+    Timestamps come from time.monotonic() of the service process. They are
+    only meaningful relative to each other, so clients should build the
+    waterfall from the differences between stages.
+    """
+
+    def __init__(self):
+
+        self.utterance = 0
+        self.stages = {}
+
+
+    def start(self):
+
+        self.utterance += 1
+        self.stages = {}
+
+
+    def mark(self, stage, timestamp=None):
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        self.stages[TimelineStage(stage).value] = timestamp
+
+
+    def to_dict(self):
+
+        stages = sorted(self.stages.items(), key=lambda x: x[1])
+
+        return {
+            "utterance": self.utterance,
+            "clock": "monotonic",
+            "stages": dict(stages)
+        }
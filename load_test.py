@@ -0,0 +1,173 @@
+
+"""
+Load test of the hotword service with virtual audio inputs.
+
+Start the STT stub and the service with virtual_audio_files set in
+config.py, so that every device index plays back a WAV file with a hotword
+and a command in it:
+
+    STT_STUB_DELAY_S=0.2 uvicorn stt_stub_server:app --port 5000
+    python main.py
+    python load_test.py --server-pid <pid> --sessions 1,2,4,8,16 --hotwords hey_jarvis
+
+For every session count, the tool keeps that many WebSocket sessions open
+(one virtual device each) for --duration seconds. It then reports:
+  - p50/p95/p99 of the detection latency (audio captured to hotword fired)
+  - p50/p95/p99 of the transcription latency (silence detected to transcript received)
+  - the CPU and RSS of the service process
+  - audio blocks the service dropped
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import urllib.request
+import websockets
+
+from latency_stats import LatencyWindow
+from process_memory import memory_usage, cpu_seconds
+
+
+def server_stats(base_url):
+
+    with urllib.request.urlopen(f"{base_url}/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+async def run_session(url, params, dev_index, duration_s, results):
+
+    params = {**params, "dev_index": dev_index, "timeline": True}
+
+    async with websockets.connect(url) as websocket:
+
+        await websocket.send(json.dumps(params))
+        deadline = time.monotonic() + duration_s
+
+        while True:
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                raw = await asyncio.wait_for(websocket.recv(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+
+            message = json.loads(raw)
+
+            if message["status"] != "ok":
+                results["errors"].append(message["text"])
+                break
+
+            if message["type"] == "Timeline":
+                stages = json.loads(message["text"])["stages"]
+                if "audio_captured" in stages and "hotword_fired" in stages:
+                    results["detection"].add(stages["hotword_fired"] - stages["audio_captured"])
+                if "silence_detected" in stages and "transcript_received" in stages:
+                    results["transcription"].add(stages["transcript_received"] - stages["silence_detected"])
+
+
+def percentiles(window):
+
+    values = [window.percentile(q) for q in (50, 95, 99)]
+
+    if values[0] is None:
+        return "-"
+
+    return "/".join(f"{value * 1000:.0f}" for value in values)
+
+
+async def run_step(args, params, sessions):
+
+    # keep every sample of the step: nothing expires, and no sample count cap
+    window_s = args.duration * 10
+    results = {
+        "detection": LatencyWindow(window_s, maxlen=None),
+        "transcription": LatencyWindow(window_s, maxlen=None),
+        "errors": []
+    }
+
+    before = server_stats(args.base_url)
+    cpu_before = cpu_seconds(args.server_pid) if args.server_pid else None
+    started = time.monotonic()
+
+    await asyncio.gather(*[
+        run_session(args.url, params, dev_index, args.duration, results)
+        for dev_index in range(sessions)
+    ], return_exceptions=False)
+
+    elapsed = time.monotonic() - started
+    cpu_after = cpu_seconds(args.server_pid) if args.server_pid else None
+    memory = memory_usage(args.server_pid) if args.server_pid else None
+    after = server_stats(args.base_url)
+
+    cpu = f"{(cpu_after - cpu_before) / elapsed * 100:.0f}%" if cpu_before is not None and cpu_after is not None else "-"
+    rss = f"{memory['rss'] / (1024 * 1024):.0f}MB" if memory else "-"
+    dropped = after["audio_overruns"] - before["audio_overruns"]
+
+    print(
+        f"{sessions:>8} "
+        f"{len(results['detection']):>6} "
+        f"{percentiles(results['detection']):>16} "
+        f"{percentiles(results['transcription']):>16} "
+        f"{cpu:>6} {rss:>8} {dropped:>8}"
+    )
+
+    for error in results["errors"][:3]:
+        print(f"         error: {error}")
+
+    return dropped
+
+
+async def main():
+
+    parser = argparse.ArgumentParser(description="Load test of the hotword service with virtual audio inputs.")
+    parser.add_argument("--host", default="localhost:5600")
+    parser.add_argument("--server-pid", type=int, default=None, help="service process, for CPU and RSS")
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated session counts")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per session count")
+    parser.add_argument("--pause", type=float, default=5, help="seconds between session counts")
+    parser.add_argument("--hotwords", default="hey_jarvis", help="comma-separated hotwords")
+    parser.add_argument("--engine", default="openwakeword")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--stt-engine", default="openai_whisper")
+    parser.add_argument("--stt-model", default="small.en")
+    args = parser.parse_args()
+
+    args.url = f"ws://{args.host}/api/hotword/listen"
+    args.base_url = f"http://{args.host}/api/hotword"
+
+    params = {
+        "hotwords": [x.strip() for x in args.hotwords.split(",")],
+        "model_engine_hotword": args.engine,
+        "model_name_hotword": args.model,
+        "model_engine_stt": args.stt_engine,
+        "model_name_stt": args.stt_model,
+        "engine_execution": "thread",  # virtual devices play back in the API process
+        "events": ["Notification", "Timeline"]
+    }
+
+    print(f"{'sessions':>8} {'utts':>6} {'detect p50/95/99':>16} {'stt p50/95/99':>16} {'cpu':>6} {'rss':>8} {'dropped':>8}")
+
+    first_drop = None
+
+    for sessions in [int(x) for x in args.sessions.split(",")]:
+
+        dropped = await run_step(args, params, sessions)
+
+        if dropped and first_drop is None:
+            first_drop = sessions
+
+        await asyncio.sleep(args.pause)
+
+    if first_drop is None:
+        print("\nNo audio blocks were dropped.")
+    else:
+        print(f"\nAudio blocks started dropping at {first_drop} sessions.")
+
+
+if __name__ == "__main__":
+
+    asyncio.run(main())
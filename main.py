@@ -3,19 +3,29 @@ import json
 import threading
 import asyncio
 import logging
-import socket
-import getpass
-import platform
 import uvicorn
-from pydantic import BaseModel
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import APIRouter
 
-from hotword_models import HotwordModel
+import config
+from cpu_scheduler import cap_native_threads
+
+# before any engine loads its native libraries
+cap_native_threads(config.native_threads)
+
+from hotword_models import ENGINES
+from pipeline_manager import PipelineManager, Subscriber
+from session_params import ListenParams, PIPELINES, host_info, session_spec
+from session_channel import SessionChannel
+from grpc_server import start_grpc_server
+from device_inventory import inventory
+from audio_source import MicrophoneSource, FileSource
+from engine_vosk import VoskEngine
+from process_memory import memory_usage
 from hotword_types import MessageStatus, MessageType
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -39,24 +49,17 @@ app.add_middleware(
 
 router = APIRouter()
 
-hw_obj = HotwordModel()
-
-lock = asyncio.Lock()
-running_lock = threading.Lock()
+# created on startup, so engine worker processes importing this module do not build their own
+hw_obj = None
+grpc_obj = None
 
+# blocking session calls do not compete with other users of the default executor
+session_executor = ThreadPoolExecutor(max_workers=config.session_executor_workers, thread_name_prefix="session")
 
-class ListenParams(BaseModel):
-    dev_index: Optional[int]
-    hotwords: List[str]
-    model_engine_hotword: str
-    model_name_hotword: Optional[str]
-    model_engine_stt: str
-    model_name_stt: Optional[str]
-    target_latency: Optional[int] = 100
-    silence_duration: Optional[int] = 3
+running_lock = threading.Lock()
 
 
-async def send_message(websocket, msg_status, msg_type, msg):
+async def send_message(websocket, msg_status, msg_type, msg, dev_index=None):
 
     message = {
         "status": msg_status,
@@ -64,12 +67,29 @@ async def send_message(websocket, msg_status, msg_type, msg):
         "text": msg
     }
 
+    if dev_index is not None:
+        message["dev_index"] = dev_index
+
     try:
         await websocket.send_text(json.dumps(message))
     except Exception:
         pass
 
 
+async def receive_until_disconnect(ws: WebSocket):
+    """
+    Returns as soon as the client disconnects. Client messages are ignored.
+    """
+
+    try:
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+    except (WebSocketDisconnect, RuntimeError):
+        return
+
+
 async def safe_close(ws: WebSocket):
 
     try:
@@ -78,6 +98,33 @@ async def safe_close(ws: WebSocket):
         pass
 
 
+@app.on_event("startup")
+def startup():
+
+    global hw_obj
+    hw_obj = PipelineManager()
+
+    # custom keyword models are validated and preloaded before the first session asks for them
+    for engine in ENGINES.values():
+        if hasattr(engine, "custom_keywords"):
+            engine.custom_keywords()
+
+
+@app.on_event("startup")
+async def start_grpc():
+
+    global grpc_obj
+    if config.grpc_port:
+        grpc_obj = await start_grpc_server(hw_obj, session_executor, config.grpc_port)
+
+
+@app.on_event("shutdown")
+async def stop_grpc():
+
+    if grpc_obj:
+        await grpc_obj.stop(grace=1)
+
+
 @router.get("/health")
 def health_check():
 
@@ -89,181 +136,144 @@ async def websocket_listen(websocket: WebSocket):
 
     await websocket.accept()
 
-    if lock.locked():
+    loop = asyncio.get_event_loop()
+    ended = asyncio.Event()
+    subscriber = None
+    channel = None
 
-        await send_message(
-            websocket,
-            MessageStatus.ERROR,
-            MessageType.NOTIFICATION,
-            "Another session is already running.")
+    try:
 
-        await safe_close(websocket)
-        return
+        params_raw = await websocket.receive_text()
+        params = ListenParams(**json.loads(params_raw))
+        print(f"Received parameters from client: {params.model_dump()}")
 
-    async with lock:
+        channel = SessionChannel(websocket, loop, params.encoding, config.session_queue_size)
+        channel.start()
 
-        try:
+        channel.post(MessageStatus.OK, MessageType.HOST_INFO, host_info())
 
-            params_raw = await websocket.receive_text()
-            params = ListenParams(**json.loads(params_raw))
-            print(f"Received parameters from client: {params.model_dump()}")
+        dev_indices, spec, events = session_spec(params)
 
-            loop = asyncio.get_event_loop()
+        def on_end(dev_index, status, output):
+            if not status:
+                channel.post(MessageStatus.ERROR, MessageType.NOTIFICATION, output, dev_index)
+            if not hw_obj.subscribed_devices(subscriber):
+                loop.call_soon_threadsafe(ended.set)
+
+        subscriber = Subscriber(channel.post, on_end, events)
+
+        status, output = await loop.run_in_executor(
+            session_executor,
+            lambda: hw_obj.subscribe(
+                subscriber,
+                dev_indices,
+                spec,
+                pipeline_class=PIPELINES[spec["engine_execution"]]
+            )
+        )
 
-            #######
+        if not status:
+            subscriber = None
+            channel.post(
+                MessageStatus.ERROR,
+                MessageType.NOTIFICATION,
+                f"Cannot start hotword detection: {output}")
+            return
 
-            host_info = {
-                "hostname": socket.gethostname(),
-                "username": getpass.getuser(),
-                "platform": platform.system(),
-                "platform_version": platform.version(),
-                "architecture": platform.machine()
-            }
+        channel.post(
+            MessageStatus.OK,
+            MessageType.NOTIFICATION,
+            "Hotword detection initialized. Listening...")
 
-            host_info_str = json.dumps(host_info)
-            asyncio.run_coroutine_threadsafe(
-                send_message(websocket, MessageStatus.OK, MessageType.HOST_INFO, host_info_str),
-                loop)
+        # the session ends when the client leaves, all its pipelines stop, or the socket fails a send
+        receiver = loop.create_task(receive_until_disconnect(websocket))
+        finished = loop.create_task(ended.wait())
 
-            #######
+        done, _ = await asyncio.wait(
+            {receiver, finished, channel.task},
+            return_when=asyncio.FIRST_COMPLETED)
 
-            def dev_input_callback(dev_info):
-                dev_info_str = json.dumps(dev_info)
-                asyncio.run_coroutine_threadsafe(
-                    send_message(websocket, MessageStatus.OK, MessageType.DEV_INPUT, dev_info_str),
-                    loop)
+        if receiver in done:
+            print("Client disconnected.")
 
-            status, output = await loop.run_in_executor(
-                None,
-                lambda: hw_obj.init_audio_device(
-                    dev_index=params.dev_index,
-                    dev_input_callback=dev_input_callback
-                )
-            )
+        for task in (receiver, finished):
+            task.cancel()
 
-            if not status:
-                await send_message(
-                    websocket,
-                    MessageStatus.ERROR,
-                    MessageType.NOTIFICATION,
-                    f"init_audio_device failed: {output}")
-                await safe_close(websocket)
-                return
+        await asyncio.gather(receiver, finished, return_exceptions=True)
 
+    except Exception as e:
+        if channel:
+            channel.post(MessageStatus.ERROR, MessageType.NOTIFICATION, str(e))
+        else:
             await send_message(
                 websocket,
-                MessageStatus.OK,
+                MessageStatus.ERROR,
                 MessageType.NOTIFICATION,
-                "Audio device initialized.")
-
-            #######
-
-            status, output = await loop.run_in_executor(
-                None,
-                lambda: hw_obj.init_hotword(
-                    model_engine_hotword=params.model_engine_hotword,
-                    model_name_hotword=params.model_name_hotword,
-                    model_engine_stt=params.model_engine_stt,
-                    model_name_stt=params.model_name_stt
-                )
-            )
+                str(e))
 
-            if not status:
-                await send_message(
-                    websocket,
-                    MessageStatus.ERROR,
-                    MessageType.NOTIFICATION,
-                    f"init_hotword failed: {output}")
-                await safe_close(websocket)
-                return
+    finally:
+        if channel:
+            await channel.close()
+        await safe_close(websocket)
+        if subscriber:
+            await loop.run_in_executor(session_executor, hw_obj.unsubscribe, subscriber)
 
-            await send_message(
-                websocket,
-                MessageStatus.OK,
-                MessageType.NOTIFICATION,
-                "Hotword detection initialized. Listening...")
 
-        except Exception as e:
-            await send_message(
-                websocket,
-                MessageStatus.ERROR,
-                MessageType.NOTIFICATION,
-                str(e))
-            await safe_close(websocket)
-            hw_obj.stop_hotword_detection()
-            return
+@router.get("/stats")
+def stats():
 
-        try:
-
-            loop = asyncio.get_event_loop()
-
-            def on_hotword(text):
-                asyncio.run_coroutine_threadsafe(
-                    send_message(websocket, MessageStatus.OK, MessageType.HOTWORD, text),
-                    loop)
-
-            def on_silence(text):
-                asyncio.run_coroutine_threadsafe(
-                    send_message(websocket, MessageStatus.OK, MessageType.SILENCE, text),
-                    loop)
-
-            def on_transcription(text):
-                asyncio.run_coroutine_threadsafe(
-                    send_message(websocket, MessageStatus.OK, MessageType.TRANSCRIBED, text),
-                    loop)
-
-            future = loop.run_in_executor(
-                None,
-                hw_obj.detect_hotword_and_transcribe,
-                params.hotwords,
-                on_hotword,
-                on_silence,
-                on_transcription,
-                params.target_latency,
-                params.silence_duration)
-
-            while not future.done():
-
-                try:
-                    await asyncio.wait_for(websocket.receive_text(), timeout=0.5)
-                except asyncio.TimeoutError:
-                    continue
-                except WebSocketDisconnect:
-                    print("Client disconnected.")
-                    hw_obj.stop_hotword_detection()
-                    break
-
-            if not future.cancelled():
-                status, output = await future
-                if not status:
-                    await send_message(
-                        websocket,
-                        MessageStatus.ERROR,
-                        MessageType.NOTIFICATION,
-                        output)
-
-        except Exception as e:
-            await send_message(
-                websocket,
-                MessageStatus.ERROR,
-                MessageType.NOTIFICATION,
-                str(e))
+    return {
+        "pipelines": len(hw_obj.pipelines),
+        "audio_overruns": MicrophoneSource.overflows_total + FileSource.dropped_total,
+        "cpu": hw_obj.scheduler.report()
+    }
+
+
+@router.get("/keywords")
+def keywords():
+
+    return {
+        name: engine.custom_keywords().report()
+        for name, engine in ENGINES.items()
+        if hasattr(engine, "custom_keywords")
+    }
+
+
+@router.get("/memory")
+def memory():
+
+    return {
+        "process": memory_usage(),
+        # OpenWakeWord and Porcupine models belong to one pipeline each and are listed there
+        "vosk_models": VoskEngine.model_report(),
+        "pipelines": hw_obj.resources()
+    }
+
+
+@router.get("/devices")
+def devices():
+
+    return inventory.report()
+
+
+@router.post("/devices/refresh")
+def refresh_devices():
+
+    reinitialized = inventory.refresh()
 
-        finally:
-            await safe_close(websocket)
-            hw_obj.stop_hotword_detection()
+    return {"reinitialized": reinitialized, **inventory.report()}
 
 
 @router.post("/stop")
 def stop():
 
     if not running_lock.acquire(blocking=False):
-        return JSONResponse({"error": "Another session is in progress"}, status_code=423)
+        return JSONResponse({"error": "Another stop request is in progress"}, status_code=423)
 
     try:
 
         print("Stoping hotword detection...")
-        hw_obj.stop_hotword_detection()
+        hw_obj.stop_all()
 
         return {"text": "Hotword detection stopped."}
 
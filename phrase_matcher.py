@@ -0,0 +1,93 @@
+
+class PhraseMatcher():
+    """
+    Token-level trie for matching many phrases against recognized words.
+
+    Phrases are matched on whole words only, so "hey agent" does not match
+    inside "hey agents". Matching walks the trie from every word position,
+    so the cost depends on the number of recognized words and the length of
+    the longest phrase, not on how many phrases are registered.
+    """
+
+    def __init__(self, phrases=None, min_confidence=None):
+
+        self.root = {}
+        self.max_len = 0
+
+        for phrase in phrases or []:
+            thresholds = (min_confidence or {}).get(phrase)
+            self.add(phrase, thresholds)
+
+
+    def add(self, phrase, min_confidence=None):
+        """
+        Register a phrase. min_confidence is either a single threshold applied
+        to every word, or a list with one threshold per word.
+        """
+
+        tokens = phrase.lower().split()
+        if not tokens:
+            return
+
+        if min_confidence is None:
+            min_confidence = [0.0] * len(tokens)
+        elif isinstance(min_confidence, (int, float)):
+            min_confidence = [float(min_confidence)] * len(tokens)
+        elif len(min_confidence) != len(tokens):
+            raise ValueError(f"'{phrase}' has {len(tokens)} words but {len(min_confidence)} confidence thresholds")
+
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+
+        node[None] = (phrase, list(min_confidence))  # terminal marker
+        self.max_len = max(self.max_len, len(tokens))
+
+
+    def match(self, words):
+        """
+        Find all registered phrases in a list of Vosk word results
+        ({"word", "conf", "start", "end"}). Returns one dict per match,
+        ordered by position.
+        """
+
+        matches = []
+
+        for i in range(len(words)):
+
+            node = self.root
+
+            for j in range(i, min(i + self.max_len, len(words))):
+
+                node = node.get(words[j]["word"].lower())
+                if node is None:
+                    break
+
+                if None not in node:
+                    continue
+
+                phrase, thresholds = node[None]
+                span = words[i:j + 1]
+
+                if all(w.get("conf", 1.0) >= t for w, t in zip(span, thresholds)):
+                    matches.append({
+                        "phrase": phrase,
+                        "start": span[0].get("start"),
+                        "end": span[-1].get("end"),
+                        "conf": min(w.get("conf", 1.0) for w in span)
+                    })
+
+        return matches
+
+
+    @staticmethod
+    def words_from_result(result):
+        """
+        Word list of a Vosk result. Falls back to the plain text (with full
+        confidence) when word-level output is missing.
+        """
+
+        if result.get("result"):
+            return result["result"]
+
+        return [{"word": w, "conf": 1.0} for w in result.get("text", "").split()]
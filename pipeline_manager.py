@@ -0,0 +1,472 @@
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+from hotword_models import HotwordModel, create_stt_client, select_input_device
+from hotword_types import MessageStatus, MessageType
+from device_inventory import inventory
+from cpu_scheduler import CpuScheduler
+
+# session setup steps that run concurrently: device pipelines, and STT model loads
+join_executor = ThreadPoolExecutor(max_workers=config.session_init_workers, thread_name_prefix="join")
+load_executor = ThreadPoolExecutor(max_workers=config.session_init_workers, thread_name_prefix="load")
+
+
+class Subscriber():
+    """
+    A consumer of pipeline events, usually one WebSocket session.
+
+    deliver(msg_status, msg_type, text, dev_index) is called from pipeline
+    threads for every event that passes the filter. on_end(dev_index, status,
+    output) is called when a subscribed pipeline stops.
+    """
+
+    def __init__(self, deliver, on_end=None, events=None):
+
+        self.deliver = deliver
+        self.on_end = on_end
+        self.events = set(events) if events is not None else None
+
+
+    def accepts(self, msg_type):
+
+        return self.events is None or msg_type in self.events
+
+
+class DevicePipeline():
+    """
+    One capture and detection pipeline on one input device, shared by any
+    number of subscribers. Subscribers join and leave without restarting
+    capture or reloading models. With a feed (audio_source.ClientAudioFeed),
+    the pipeline listens to audio streamed by a client instead of a device.
+    """
+
+    def __init__(self, hw_model, spec, on_end=None, scheduler=None, feed=None):
+
+        self.hw_model = hw_model
+        self.spec = spec
+        self.on_end = on_end
+        self.scheduler = scheduler
+        self.feed = feed
+
+        self.dev_index = None
+        self.dev_info = None
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+        self.ready = threading.Event()
+        self.init_result = (False, "pipeline is not initialized")
+        self.thread = None
+        self.ended = False
+
+        self.released = False
+        self.release_lock = threading.Lock()
+
+
+    def init(self, dev_index):
+
+        def on_dev_input(dev_info):
+            self.dev_info = dev_info
+
+        # the STT model loads while the device and hotword model are set up
+        stt_load = load_executor.submit(
+            self.hw_model.load_stt_model,
+            self.spec["model_engine_stt"],
+            self.spec["model_name_stt"])
+
+        try:
+
+            if self.feed:
+                status, output = self.hw_model.init_audio_stream(self.feed, on_dev_input)
+            else:
+                status, output = self.hw_model.init_audio_device(
+                    dev_index=dev_index,
+                    dev_input_callback=on_dev_input)
+
+            if not status:
+                stt_load.result()
+                self.init_result = (False, f"init_audio_device failed: {output}")
+                return self.init_result
+
+            self.dev_index = self.hw_model.input_dev_index
+
+            status, output = self.hw_model.init_hotword(
+                model_engine_hotword=self.spec["model_engine_hotword"],
+                model_name_hotword=self.spec["model_name_hotword"],
+                model_engine_stt=self.spec["model_engine_stt"],
+                model_name_stt=self.spec["model_name_stt"],
+                local_stt=self.spec["local_stt"],
+                load_stt=False)
+
+            if not status:
+                stt_load.result()
+                self.init_result = (False, f"init_hotword failed: {output}")
+                return self.init_result
+
+            status, output = stt_load.result()
+
+            if not status:
+                self.init_result = (False, f"load_stt_model failed: {output}")
+                return self.init_result
+
+            self.init_result = (True, None)
+            return self.init_result
+
+        finally:
+            self.ready.set()
+
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+
+        if self.feed:
+            self.feed.close()
+
+        self.hw_model.interrupt()
+
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+            # the detection loop clears the flag when it starts, which may have been after the first interrupt
+            self.hw_model.interrupt()
+
+        self.__release()
+
+
+    def subscribe(self, subscriber):
+
+        with self.lock:
+            if self.ended:
+                return False
+            self.subscribers.append(subscriber)
+
+        self.__update_opt_in()
+
+        if self.dev_info and subscriber.accepts(MessageType.DEV_INPUT):
+            subscriber.deliver(MessageStatus.OK, MessageType.DEV_INPUT, self.dev_info, self.dev_index)
+
+        return True
+
+
+    def unsubscribe(self, subscriber):
+        """
+        Returns the number of remaining subscribers.
+        """
+
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            remaining = len(self.subscribers)
+
+        self.__update_opt_in()
+
+        return remaining
+
+
+    def publish(self, msg_type, text):
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.accepts(msg_type):
+                subscriber.deliver(MessageStatus.OK, msg_type, text, self.dev_index)
+
+
+    def __run(self):
+
+        spec = self.spec
+
+        if self.scheduler:
+            # the engine runs in this thread, or in the worker process of process execution
+            worker = getattr(self.hw_model, "process", None)
+            if worker:
+                self.scheduler.attach(self, pid=worker.pid)
+            else:
+                self.scheduler.attach(self, tid=threading.get_native_id())
+
+        try:
+            status, output = self.hw_model.detect_hotword_and_transcribe(
+                spec["hotwords"],
+                lambda text: self.publish(MessageType.HOTWORD, text),
+                lambda text: self.publish(MessageType.SILENCE, text),
+                lambda text: self.publish(MessageType.TRANSCRIBED, text),
+                spec["target_latency"],
+                spec["silence_duration"],
+                self.__opt_in(MessageType.TIMELINE),
+                spec["max_recording_duration"],
+                spec["recording_overflow"],
+                spec["hotword_confidence"],
+                self.__opt_in(MessageType.SCORES),
+                self.__opt_in(MessageType.PARTIAL),
+                spec["adaptive_latency"],
+                self.__opt_in(MessageType.LATENCY),
+                spec["endpointing"],
+                lambda report: self.publish(MessageType.NO_SPEECH, report))
+        except Exception as e:
+            status, output = False, str(e)
+
+        if self.on_end:
+            self.on_end(self)
+
+        with self.lock:
+            self.ended = True
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.on_end:
+                subscriber.on_end(self.dev_index, status, output)
+
+        # a pipeline that ended on its own is no longer in the manager, so nobody else stops it
+        self.__release()
+
+
+    def __opt_in(self, msg_type):
+
+        # sessions sharing the pipeline may differ in what they opted in to, so check on every message
+        def publish(payload):
+            if self.wants(msg_type):
+                self.publish(msg_type, payload)
+
+        return publish
+
+
+    def wants(self, msg_type):
+        """
+        Whether any current subscriber receives messages of this type.
+        """
+
+        with self.lock:
+            return any(subscriber.accepts(msg_type) for subscriber in self.subscribers)
+
+
+    def __update_opt_in(self):
+
+        # scores and partial transcripts cost work on every block, so the engines skip them while unwanted
+        self.hw_model.want_scores(self.wants(MessageType.SCORES) or self.wants(MessageType.PARTIAL))
+
+
+    def __release(self):
+        """
+        Free the engine, worker process and CPU reservation. Runs once, no
+        matter whether the pipeline was stopped or ended on its own.
+        """
+
+        with self.release_lock:
+
+            if self.released:
+                return
+
+            self.released = True
+
+            if self.scheduler:
+                self.scheduler.release(self)
+
+            if self.feed:
+                self.feed.close()
+
+            self.hw_model.stop_hotword_detection()
+
+
+class PipelineManager():
+    """
+    Keeps one DevicePipeline per input device.
+
+    The first session on a device creates and initializes its pipeline.
+    Later sessions with the same settings subscribe to the running one, and
+    the pipeline is stopped when its last subscriber leaves. A device that
+    already runs with different settings is rejected.
+    """
+
+    def __init__(self):
+
+        self.stt_client = create_stt_client()
+
+        self.pipelines = {}
+        self.lock = threading.Lock()
+
+        self.scheduler = CpuScheduler(
+            budget_cores=config.cpu_budget_cores,
+            engine_costs=config.engine_cpu_cost,
+            cores=config.cpu_pin_cores,
+            sample_s=config.cpu_sample_s)
+
+        # PortAudio may only be reinitialized for a hotplug while no pipeline captures
+        inventory.idle_check = self.idle
+
+
+    def idle(self):
+
+        # client streams do not hold PortAudio streams
+        with self.lock:
+            return not any(pipeline.feed is None for pipeline in self.pipelines.values())
+
+
+    def subscribe(self, subscriber, dev_indices, spec, pipeline_class=HotwordModel):
+
+        if not dev_indices:
+            dev_indices = [None]  # auto-select the best microphone
+
+        resolved = []
+
+        for dev_index in dev_indices:
+
+            if dev_index is None:
+                dev_index = select_input_device()
+                if dev_index is None:
+                    return False, "No suitable input device found."
+
+            resolved.append(dev_index)
+
+        resolved = list(dict.fromkeys(resolved))
+
+        # devices are set up concurrently, so setup takes as long as the slowest one
+        futures = [
+            join_executor.submit(self.__join, subscriber, dev_index, spec, pipeline_class)
+            for dev_index in resolved
+        ]
+
+        results = [future.result() for future in futures]
+
+        joined = [output for status, output in results if status]
+        failed = [(dev_index, output) for dev_index, (status, output) in zip(resolved, results) if not status]
+
+        if failed:
+            self.__leave(subscriber, joined)
+            dev_index, output = failed[0]
+            return False, f"device {dev_index}: {output}"
+
+        return True, None
+
+
+    def subscribe_stream(self, subscriber, feed, spec, pipeline_class=HotwordModel):
+        """
+        Start a pipeline of its own on audio streamed by the client.
+        """
+
+        status, output = self.__join(subscriber, feed.name, spec, pipeline_class, feed)
+        if not status:
+            return False, output
+
+        return True, None
+
+
+    def subscribed_devices(self, subscriber):
+
+        with self.lock:
+            return [
+                dev_index for dev_index, pipeline in self.pipelines.items()
+                if subscriber in pipeline.subscribers
+            ]
+
+
+    def unsubscribe(self, subscriber):
+
+        with self.lock:
+            pipelines = list(self.pipelines.values())
+
+        self.__leave(subscriber, pipelines)
+
+
+    def resources(self):
+
+        with self.lock:
+            pipelines = list(self.pipelines.items())
+
+        return [
+            {
+                "dev_index": dev_index,
+                "subscribers": len(pipeline.subscribers),
+                "execution": pipeline.spec["engine_execution"],
+                **pipeline.hw_model.resources()
+            }
+            for dev_index, pipeline in pipelines
+        ]
+
+
+    def stop_all(self):
+
+        with self.lock:
+            pipelines = list(self.pipelines.values())
+            self.pipelines = {}
+
+        for pipeline in pipelines:
+            pipeline.stop()
+
+
+    def __join(self, subscriber, dev_index, spec, pipeline_class, feed=None):
+
+        with self.lock:
+
+            pipeline = self.pipelines.get(dev_index)
+            created = pipeline is None
+
+            if created:
+
+                pipeline = DevicePipeline(
+                    pipeline_class(stt_client=self.stt_client),
+                    spec,
+                    self.__remove,
+                    self.scheduler,
+                    feed)
+
+                # only new pipelines cost CPU, joining a running one is free
+                status, output = self.scheduler.admit(pipeline, spec["model_engine_hotword"])
+                if not status:
+                    return False, output
+
+                self.pipelines[dev_index] = pipeline
+
+            elif pipeline.spec != spec:
+                return False, "device is already in use with different settings."
+
+        if created:
+            status, output = pipeline.init(dev_index)
+        else:
+            pipeline.ready.wait()
+            status, output = pipeline.init_result
+
+        if not status:
+            self.__remove(pipeline)
+            if created:
+                pipeline.stop()
+            return False, output
+
+        if not pipeline.subscribe(subscriber):
+            return False, "pipeline has stopped."
+
+        if created:
+            pipeline.start()
+
+        return True, pipeline
+
+
+    def __leave(self, subscriber, pipelines):
+
+        for pipeline in pipelines:
+
+            if pipeline.unsubscribe(subscriber) > 0:
+                continue
+
+            with self.lock:
+                idle = self.pipelines.get(pipeline.dev_index) is pipeline and not pipeline.subscribers
+                if idle:
+                    del self.pipelines[pipeline.dev_index]
+
+            if idle:
+                pipeline.stop()
+
+
+    def __remove(self, pipeline):
+
+        with self.lock:
+            for dev_index, other in list(self.pipelines.items()):
+                if other is pipeline:
+                    del self.pipelines[dev_index]
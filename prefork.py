@@ -0,0 +1,142 @@
+
+"""
+Pre-forked serving mode.
+
+The parent process loads the models listed in prefork_vosk_models once,
+opens the listening socket and then forks the workers. Model memory is
+inherited copy-on-write, so it is shared by all workers instead of being
+loaded once per worker. Workers that exit are replaced, and the shared and
+private RSS of every worker is printed every prefork_report_s seconds.
+
+    python prefork.py
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import uvicorn
+
+import config
+from cpu_scheduler import cap_native_threads
+
+cap_native_threads(config.native_threads)
+
+from engine_vosk import VoskEngine
+from process_memory import memory_usage, format_usage
+
+
+def preload_models():
+
+    for model_name in config.prefork_vosk_models:
+        print(f"\n🔄 Preloading Vosk model '{model_name}'...")
+        # the reference is never released, so workers never free the inherited copy
+        VoskEngine.acquire_model(model_name)
+
+
+def open_socket(host, port):
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+def spawn_worker(sock):
+
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    status = 0
+
+    try:
+        server = uvicorn.Server(uvicorn.Config("main:app", log_level="info"))
+        server.run(sockets=[sock])
+    except Exception as e:
+        print(f"Worker {os.getpid()} failed: {e}", file=sys.stderr)
+        status = 1
+
+    os._exit(status)
+
+
+def report(workers):
+
+    print(f"Parent {os.getpid()}: {format_usage(memory_usage())}")
+
+    for pid in workers:
+        print(f"Worker {pid}: {format_usage(memory_usage(pid))}")
+
+
+def main(host="0.0.0.0", port=5600, worker_count=None):
+
+    worker_count = worker_count or config.prefork_workers
+
+    preload_models()
+
+    # keep the collector from touching (and so copying) the objects inherited by the workers
+    gc.collect()
+    gc.freeze()
+
+    sock = open_socket(host, port)
+    workers = set()
+    state = {"stopping": False}
+
+    def on_stop(signum, frame):
+        state["stopping"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    print(f"Starting {worker_count} Hotword workers on http://{host}:{port}")
+
+    last_report = time.monotonic()
+
+    while not state["stopping"]:
+
+        while len(workers) < worker_count:
+            workers.add(spawn_worker(sock))
+
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+
+        if pid in workers:
+            print(f"Worker {pid} exited, starting a new one")
+            workers.discard(pid)
+
+        if config.prefork_report_s and time.monotonic() - last_report >= config.prefork_report_s:
+            report(workers)
+            last_report = time.monotonic()
+
+        time.sleep(0.5)
+
+    print("Stopping workers...")
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+    sock.close()
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,68 @@
+
+import os
+
+
+def current_rss():
+    """
+    Resident set size of this process (in bytes), cheap enough to take around
+    a model load. Returns 0 where /proc is not available.
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def memory_usage(pid="self"):
+    """
+    RSS of a process split into shared and private pages (in bytes), read
+    from /proc/<pid>/smaps_rollup. PSS charges each shared page to the
+    processes sharing it in equal parts. Returns None where the kernel does
+    not provide the file.
+    """
+
+    fields = {}
+
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    }
+
+
+def format_usage(usage):
+
+    if usage is None:
+        return "n/a"
+
+    return " ".join(f"{name}={value / (1024 * 1024):.0f}MB" for name, value in usage.items())
+
+
+def cpu_seconds(pid="self", tid=None):
+    """
+    CPU time (user + system, in seconds) used by a process, or by one of its
+    threads when tid is given. Returns None where /proc is not available.
+    """
+
+    path = f"/proc/{pid}/task/{tid}/stat" if tid else f"/proc/{pid}/stat"
+
+    try:
+        with open(path) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+    # utime and stime, fields 14 and 15 of the stat line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
@@ -0,0 +1,138 @@
+
+class RecordingBuffer():
+    """
+    Preallocated, growable PCM buffer for one recording.
+
+    Audio blocks are copied straight from the PortAudio buffer into a single
+    bytearray, so no per-block bytes objects are created and the final payload
+    is exposed as a memoryview without joining or copying the data again.
+    The buffer never grows past max_duration_s of audio or max_bytes,
+    whichever is smaller.
+    """
+
+    def __init__(
+        self,
+        sample_rate,
+        channels,
+        max_duration_s=30,
+        max_bytes=16*1024*1024,
+        initial_duration_s=5,
+        sample_width=2):
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+        bytes_per_second = sample_rate * channels * sample_width
+        frame_bytes = channels * sample_width
+
+        capacity = min(int(max_duration_s * bytes_per_second), max_bytes)
+        self.max_bytes = capacity - capacity % frame_bytes  # keep whole sample frames
+
+        initial_bytes = min(int(initial_duration_s * bytes_per_second), self.max_bytes)
+        self.buffer = bytearray(initial_bytes)
+        self.length = 0
+
+        # VAD decisions made while recording
+        self.voiced_ms = 0
+        self.analyzed_ms = 0
+        self.voice_start = None  # byte offsets of the first and last voiced frame
+        self.voice_end = None
+
+
+    def __len__(self):
+
+        return self.length
+
+
+    def append(self, data):
+        """
+        Copy as much of data as fits. Returns the number of bytes written,
+        which is less than len(data) once the buffer is full.
+        """
+
+        data = memoryview(data).cast("B")
+
+        size = min(len(data), self.max_bytes - self.length)
+        if size <= 0:
+            return 0
+
+        end = self.length + size
+
+        if end > len(self.buffer):
+            self.__grow(end)
+
+        self.buffer[self.length:end] = data[:size]
+        self.length = end
+
+        return size
+
+
+    def is_full(self):
+
+        return self.length >= self.max_bytes
+
+
+    def duration(self):
+
+        return self.length / (self.sample_rate * self.channels * self.sample_width)
+
+
+    def add_vad(self, is_speech, frame_ms, start=None, end=None):
+        """
+        Account the VAD decision of one frame of this recording. start and
+        end are the byte offsets of the frame within the recording.
+        """
+
+        self.analyzed_ms += frame_ms
+
+        if not is_speech:
+            return
+
+        self.voiced_ms += frame_ms
+
+        if start is not None and end is not None and end > 0:
+            if self.voice_start is None:
+                self.voice_start = max(start, 0)
+            self.voice_end = min(end, self.length)
+
+
+    def voiced_ratio(self):
+
+        return self.voiced_ms / self.analyzed_ms if self.analyzed_ms else 0.0
+
+
+    def view(self):
+
+        return memoryview(self.buffer)[:self.length]
+
+
+    def voiced_view(self, guard_ms=200):
+        """
+        Like view(), but only the span from the first to the last voiced
+        frame, widened by guard_ms on each side. The whole recording is
+        returned when no voiced frame was located.
+        """
+
+        if self.voice_start is None:
+            return self.view()
+
+        frame_bytes = self.channels * self.sample_width
+        guard = int(guard_ms * self.sample_rate / 1000) * frame_bytes
+
+        start = max(self.voice_start - guard, 0)
+        end = min(self.voice_end + guard, self.length)
+
+        start -= start % frame_bytes
+        end -= end % frame_bytes
+
+        return memoryview(self.buffer)[start:end]
+
+
+    def __grow(self, min_size):
+
+        new_size = min(max(min_size, len(self.buffer) * 2), self.max_bytes)
+
+        new_buffer = bytearray(new_size)
+        new_buffer[:self.length] = memoryview(self.buffer)[:self.length]
+        self.buffer = new_buffer
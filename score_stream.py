@@ -0,0 +1,89 @@
+
+import time
+
+
+class ScoreStream():
+    """
+    Throttles per-keyword detection scores and partial transcripts.
+
+    The detection loop feeds every frame through add_scores() and
+    set_partial(), which only update a few dict entries. At most `rate`
+    times per second the scores aggregated over the interval (max or mean)
+    and the latest changed partial text are handed to the callbacks.
+
+    `wanted` tells whether anyone receives the output right now. Engines
+    check active() before doing the work, so it is skipped otherwise.
+    """
+
+    def __init__(self, rate=5, mode="max", on_scores=None, on_partial=None, wanted=None):
+
+        if mode not in ("max", "mean"):
+            raise ValueError(f"Unknown score aggregation '{mode}'. Choose from ['max', 'mean']")
+
+        self.interval = 1.0 / rate
+        self.mode = mode
+        self.on_scores = on_scores
+        self.on_partial = on_partial
+        self.wanted = wanted
+
+        self.totals = {}
+        self.frames = 0
+        self.partial = None
+        self.partial_sent = None
+        self.last_emit = time.monotonic()
+
+
+    def active(self):
+
+        return self.wanted is None or self.wanted()
+
+
+    def add_scores(self, scores):
+
+        if self.mode == "max":
+            for name, score in scores.items():
+                if score > self.totals.get(name, 0.0):
+                    self.totals[name] = score
+        else:
+            for name, score in scores.items():
+                self.totals[name] = self.totals.get(name, 0.0) + score
+
+        self.frames += 1
+        self.flush_if_due()
+
+
+    def set_partial(self, text):
+
+        self.partial = text
+        self.flush_if_due()
+
+
+    def flush_if_due(self):
+
+        now = time.monotonic()
+        if now - self.last_emit < self.interval:
+            return
+
+        interval_s = now - self.last_emit
+        self.last_emit = now
+
+        if self.frames and self.on_scores:
+
+            if self.mode == "max":
+                scores = dict(self.totals)
+            else:
+                scores = {k: v / self.frames for k, v in self.totals.items()}
+
+            self.on_scores({
+                "aggregate": self.mode,
+                "interval_s": round(interval_s, 3),
+                "frames": self.frames,
+                "scores": {k: round(float(v), 4) for k, v in scores.items()}
+            })
+
+        self.totals = {}
+        self.frames = 0
+
+        if self.partial and self.partial != self.partial_sent and self.on_partial:
+            self.on_partial(self.partial)
+            self.partial_sent = self.partial
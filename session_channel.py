@@ -0,0 +1,210 @@
+
+import json
+import asyncio
+import collections
+from enum import Enum
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from hotword_types import MessageType
+
+ENCODINGS = ("json", "msgpack")
+
+# what happens to a queued message type when the client falls behind
+RELIABLE = "reliable"   # evicts droppable messages to make room, dropped only as a last resort
+DROP = "drop"           # dropped when the queue is full
+COALESCE = "coalesce"   # only the latest pending message per type and device is kept
+
+POLICIES = {
+    MessageType.TIMELINE.value: COALESCE,
+    MessageType.SCORES.value: COALESCE,
+    MessageType.PARTIAL.value: COALESCE,
+    MessageType.LATENCY.value: COALESCE,
+}
+
+
+class SessionChannel():
+    """
+    Bounded outbound message queue of one WebSocket session.
+
+    Pipeline threads post messages with a single call_soon_threadsafe each,
+    and one sender task per session writes them to the socket in order. The
+    queue never grows past maxsize, so a slow client costs a bounded amount
+    of memory; high-rate message types are coalesced or dropped first.
+    Messages are encoded as JSON text frames or MessagePack binary frames,
+    or handed as dicts to the send coroutine function of other transports.
+    """
+
+    def __init__(self, websocket, loop, encoding="json", maxsize=256, send=None):
+
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}'. Choose from {list(ENCODINGS)}")
+
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("msgpack encoding requires the 'msgpack' package")
+
+        self.websocket = websocket
+        self.loop = loop
+        self.encoding = encoding
+        self.maxsize = maxsize
+        self.send = send
+
+        self.queue = collections.deque()
+        self.slots = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sending = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+
+    def start(self):
+
+        self.task = self.loop.create_task(self.__send_loop())
+
+
+    def post(self, msg_status, msg_type, text, dev_index=None):
+        """
+        Queue a message. Safe to call from any thread.
+        """
+
+        message = {
+            "status": self.__plain(msg_status),
+            "type": self.__plain(msg_type),
+            "text": text
+        }
+
+        if dev_index is not None:
+            message["dev_index"] = dev_index
+
+        try:
+            self.loop.call_soon_threadsafe(self.__put, message)
+        except RuntimeError:
+            pass  # event loop is closed
+
+
+    async def close(self, timeout=1):
+        """
+        Flush what is queued (up to timeout seconds) and stop the sender task.
+        """
+
+        if not self.task:
+            return
+
+        await asyncio.sleep(0)  # let already scheduled posts reach the queue
+
+        deadline = self.loop.time() + timeout
+        while (self.queue or self.sending) and not self.task.done() and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+        self.task.cancel()
+
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+        self.task = None
+
+        if self.dropped or self.coalesced:
+            print(f"Session queue: sent={self.sent} dropped={self.dropped} coalesced={self.coalesced}")
+
+
+    def __put(self, message):
+
+        policy = POLICIES.get(message["type"], RELIABLE)
+
+        if policy == COALESCE:
+
+            key = (message["type"], message.get("dev_index"))
+            pending = self.slots.get(key)
+
+            if pending is not None:
+                pending.clear()
+                pending.update(message)  # replace the queued message in place
+                self.coalesced += 1
+                return
+
+        if len(self.queue) >= self.maxsize:
+            if policy != RELIABLE or not self.__evict():
+                self.dropped += 1
+                return
+
+        if policy == COALESCE:
+            self.slots[key] = message
+
+        self.queue.append(message)
+        self.wakeup.set()
+
+
+    def __evict(self):
+
+        for message in self.queue:
+
+            if POLICIES.get(message["type"], RELIABLE) == RELIABLE:
+                continue
+
+            self.queue.remove(message)
+            self.__release_slot(message)
+            self.dropped += 1
+            return True
+
+        return False
+
+
+    def __release_slot(self, message):
+
+        key = (message["type"], message.get("dev_index"))
+        if self.slots.get(key) is message:
+            del self.slots[key]
+
+
+    async def __send_loop(self):
+
+        while True:
+
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            message = self.queue.popleft()
+            self.__release_slot(message)
+
+            self.sending = True
+
+            try:
+                await self.__send(message)
+            except Exception:
+                break  # the socket is gone
+            finally:
+                self.sending = False
+
+            self.sent += 1
+
+
+    async def __send(self, message):
+
+        if self.send:
+            await self.send(message)
+            return
+
+        if self.encoding == "msgpack":
+            await self.websocket.send_bytes(msgpack.packb(message, use_bin_type=True))
+            return
+
+        if not isinstance(message["text"], str):
+            message = {**message, "text": json.dumps(message["text"])}
+
+        await self.websocket.send_text(json.dumps(message))
+
+
+    @staticmethod
+    def __plain(value):
+
+        return value.value if isinstance(value, Enum) else value
@@ -0,0 +1,94 @@
+
+import socket
+import getpass
+import platform
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Union, Literal
+
+import config
+from hotword_models import HotwordModel
+from engine_worker import ProcessHotwordModel
+from hotword_types import MessageType
+
+PIPELINES = {
+    "thread": HotwordModel,
+    "process": ProcessHotwordModel
+}
+
+
+class ListenParams(BaseModel):
+    dev_index: Optional[int]
+    dev_indices: Optional[List[int]] = None
+    hotwords: List[str]
+    model_engine_hotword: str
+    model_name_hotword: Optional[str]
+    model_engine_stt: str
+    model_name_stt: Optional[str]
+    target_latency: Optional[int] = 100
+    adaptive_latency: Optional[bool] = False
+    silence_duration: Optional[int] = 3
+    endpointing: Optional[Literal["fixed", "adaptive"]] = "fixed"
+    timeline: Optional[bool] = False
+    scores: Optional[bool] = False
+    max_recording_duration: Optional[int] = 30
+    recording_overflow: Optional[Literal["cut", "split"]] = "cut"
+    hotword_confidence: Optional[Dict[str, Union[float, List[float]]]] = None
+    engine_execution: Optional[Literal["thread", "process"]] = None
+    local_stt: Optional[Literal["never", "always", "auto"]] = None
+    events: Optional[List[MessageType]] = None
+    encoding: Optional[Literal["json", "msgpack"]] = "json"
+
+
+def host_info():
+
+    return {
+        "hostname": socket.gethostname(),
+        "username": getpass.getuser(),
+        "platform": platform.system(),
+        "platform_version": platform.version(),
+        "architecture": platform.machine()
+    }
+
+
+def session_spec(params):
+    """
+    Returns (dev_indices, spec, events) of a session: the requested devices,
+    the pipeline settings, and the message types delivered to it.
+    """
+
+    dev_indices = params.dev_indices
+    if not dev_indices and params.dev_index is not None:
+        dev_indices = [params.dev_index]
+    if not dev_indices:
+        dev_indices = config.input_dev_indices
+
+    spec = {
+        "model_engine_hotword": params.model_engine_hotword,
+        "model_name_hotword": params.model_name_hotword,
+        "model_engine_stt": params.model_engine_stt,
+        "model_name_stt": params.model_name_stt,
+        "hotwords": sorted(x.lower() for x in params.hotwords),
+        "target_latency": params.target_latency,
+        "adaptive_latency": params.adaptive_latency,
+        "silence_duration": params.silence_duration,
+        "endpointing": params.endpointing,
+        "max_recording_duration": params.max_recording_duration,
+        "recording_overflow": params.recording_overflow,
+        "hotword_confidence": params.hotword_confidence,
+        "engine_execution": params.engine_execution or config.engine_execution,
+        "local_stt": params.local_stt or config.local_stt
+    }
+
+    # opt-in message types are only delivered when requested
+    opt_in = {
+        MessageType.TIMELINE: params.timeline,
+        MessageType.SCORES: params.scores,
+        MessageType.PARTIAL: params.scores
+    }
+
+    if params.events is None:
+        events = [t for t in MessageType if opt_in.get(t, True)]
+    else:
+        events = params.events + [t for t, enabled in opt_in.items() if enabled]
+
+    return dev_indices, spec, events
@@ -50,6 +50,13 @@ class STT_REST_API_Client(REST_API_Client):
         return self.request("POST", url, params=params, timeout=5*60)
 
 
+    def loaded_models(self):
+
+        url = f"{self.baseurl}/models/loaded"
+
+        return self.request("GET", url)
+
+
     def transcribe_file(self, file_path, engine, model_name):
 
         url = f"{self.baseurl}/transcribe/file"
@@ -64,3 +71,32 @@ class STT_REST_API_Client(REST_API_Client):
             files = {"file": (os.path.basename(file_path), f, "audio/wav")}
 
             return self.request("POST", url, params=params, files=files, timeout=5*60)
+
+
+    def transcribe_files(self, file_paths, engine, model_name):
+        """
+        Transcribe several files with one request to the batch endpoint.
+        The results are returned in the order of file_paths.
+        """
+
+        url = f"{self.baseurl}/transcribe/batch"
+
+        params = {
+            "engine": engine,
+            "model_name": model_name
+        }
+
+        handles = [open(file_path, "rb") for file_path in file_paths]
+
+        try:
+
+            files = [
+                ("files", (os.path.basename(file_path), f, "audio/wav"))
+                for file_path, f in zip(file_paths, handles)
+            ]
+
+            return self.request("POST", url, params=params, files=files, timeout=5*60)
+
+        finally:
+            for f in handles:
+                f.close()
@@ -0,0 +1,133 @@
+
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchingSTTClient():
+    """
+    Batches transcription requests of concurrent sessions.
+
+    transcribe_file() blocks its caller as usual, but the request is queued
+    and a dispatcher thread collects the utterances that finish within
+    window_ms of each other. Requests for the same engine and model are sent
+    as one multi-file request to the batch endpoint of the STT service, and
+    every result is handed back to the session that asked for it. A lone
+    request is sent to the regular single-file endpoint.
+    """
+
+    def __init__(self, stt_client, window_ms=50, max_batch=8, max_inflight=2):
+
+        self.stt_client = stt_client
+        self.window_s = window_ms / 1000
+        self.max_batch = max_batch
+
+        self.pending = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="stt-batch")
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"files": 0, "requests": 0, "batched_files": 0}
+
+        self.dispatcher = threading.Thread(target=self.__dispatch, daemon=True)
+        self.dispatcher.start()
+
+
+    def check_health(self, *args, **kwargs):
+
+        return self.stt_client.check_health(*args, **kwargs)
+
+
+    def load_model(self, engine, model_name):
+
+        return self.stt_client.load_model(engine, model_name)
+
+
+    def loaded_models(self):
+
+        return self.stt_client.loaded_models()
+
+
+    def transcribe_file(self, file_path, engine, model_name):
+
+        request = {
+            "file_path": file_path,
+            "engine": engine,
+            "model_name": model_name,
+            "done": threading.Event(),
+            "result": None
+        }
+
+        self.pending.put(request)
+        request["done"].wait()
+
+        return request["result"]
+
+
+    def __dispatch(self):
+
+        while True:
+
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.window_s
+
+            while len(batch) < self.max_batch:
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for request in batch:
+                groups.setdefault((request["engine"], request["model_name"]), []).append(request)
+
+            for (engine, model_name), group in groups.items():
+                self.executor.submit(self.__submit, group, engine, model_name)
+
+
+    def __submit(self, group, engine, model_name):
+
+        try:
+
+            if len(group) == 1:
+                results = [self.stt_client.transcribe_file(group[0]["file_path"], engine, model_name)]
+            else:
+                results = self.__transcribe_batch(group, engine, model_name)
+
+        except Exception as e:
+            results = [(False, str(e))] * len(group)
+
+        with self.stats_lock:
+            self.stats["files"] += len(group)
+            self.stats["requests"] += 1
+            if len(group) > 1:
+                self.stats["batched_files"] += len(group)
+
+        for request, result in zip(group, results):
+            request["result"] = result
+            request["done"].set()
+
+
+    def __transcribe_batch(self, group, engine, model_name):
+
+        status, output = self.stt_client.transcribe_files(
+            [request["file_path"] for request in group],
+            engine,
+            model_name)
+
+        if not status:
+            return [(False, output)] * len(group)
+
+        results = output.get("results", [])
+        if len(results) != len(group):
+            return [(False, f"batch returned {len(results)} results for {len(group)} files")] * len(group)
+
+        return [
+            (False, result["error"]) if "error" in result else (True, result)
+            for result in results
+        ]
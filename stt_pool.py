@@ -0,0 +1,255 @@
+
+import time
+import threading
+
+from speech_to_text_api import STT_REST_API_Client
+
+BALANCING = ("least_outstanding", "latency")
+
+
+class STTEndpoint():
+
+    def __init__(self, url):
+
+        self.url = url
+        self.client = STT_REST_API_Client(url=url)
+
+        self.outstanding = 0
+        self.latency_s = None  # EWMA of successful request durations
+        self.failures = 0
+        self.ejected_until = 0.0
+
+
+    def available(self, now):
+
+        return self.ejected_until <= now
+
+
+    def cost(self, balancing):
+
+        if balancing == "latency":
+            # unknown latency sorts first, so new endpoints get measured
+            return ((self.outstanding + 1) * (self.latency_s or 0.0), self.outstanding)
+
+        # ties go to the faster endpoint
+        return (self.outstanding, self.latency_s or 0.0)
+
+
+    def report(self, now):
+
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency_s * 1000) if self.latency_s is not None else None,
+            "failures": self.failures,
+            "ejected": not self.available(now)
+        }
+
+
+class STTEndpointPool():
+    """
+    Spreads STT requests over several STT service endpoints.
+
+    Each request goes to the available endpoint with the fewest outstanding
+    requests, or with the lowest expected wait (outstanding requests times
+    average latency) when balancing is "latency". An endpoint that fails
+    eject_failures times in a row is ejected for eject_s seconds, and a
+    failed request is retried on the next endpoint. Client errors (HTTP 4xx)
+    are returned as they are, since another endpoint would reject them too.
+    """
+
+    def __init__(self, urls, balancing="least_outstanding", eject_failures=3, eject_s=30):
+
+        if balancing not in BALANCING:
+            raise ValueError(f"Unknown STT balancing '{balancing}'. Choose from {list(BALANCING)}")
+
+        if not urls:
+            raise ValueError("STT endpoint pool needs at least one url")
+
+        self.endpoints = [STTEndpoint(url) for url in dict.fromkeys(urls)]
+        self.balancing = balancing
+        self.eject_failures = eject_failures
+        self.eject_s = eject_s
+
+        self.lock = threading.Lock()
+
+
+    def check_health(self, max_try=10, try_wait=30):
+        """
+        Wait until at least one endpoint is healthy. Unhealthy endpoints are ejected.
+        """
+
+        for i in range(0, max_try):
+
+            healthy = 0
+
+            for endpoint in self.endpoints:
+
+                status, output = endpoint.client.request("GET", f"{endpoint.client.baseurl}/health")
+
+                with self.lock:
+                    if status:
+                        endpoint.failures = 0
+                        endpoint.ejected_until = 0.0
+                    else:
+                        endpoint.ejected_until = time.monotonic() + self.eject_s
+
+                if status:
+                    healthy += 1
+                else:
+                    print(f"SST endpoint {endpoint.url} health check failed: {output}")
+
+            if healthy:
+                return True
+
+            print(f"try ({i+1}/{max_try}): no healthy SST endpoint")
+
+            time.sleep(try_wait)
+
+        return False
+
+
+    def load_model(self, engine, model_name):
+        """
+        Load the model on every available endpoint, so any of them can serve it.
+        """
+
+        errors = []
+        attempted = self.__available()
+
+        if not attempted:
+            return False, "no STT endpoint available"
+
+        for endpoint in attempted:
+
+            with self.lock:
+                endpoint.outstanding += 1
+
+            status, output = endpoint.client.load_model(engine, model_name)
+            self.__done(endpoint, status, None, output)
+
+            if not status:
+                errors.append(f"{endpoint.url}: {output}")
+
+        if len(errors) == len(attempted):
+            return False, "; ".join(errors)
+
+        return True, None
+
+
+    def loaded_models(self):
+        """
+        Models loaded on every available endpoint.
+        """
+
+        loaded = None
+
+        for endpoint in self.__available():
+
+            status, output = endpoint.client.loaded_models()
+            if not status:
+                return False, f"{endpoint.url}: {output}"
+
+            models = output.get("models", [])
+            loaded = models if loaded is None else [m for m in loaded if m in models]
+
+        return True, {"models": loaded or []}
+
+
+    def transcribe_file(self, file_path, engine, model_name):
+
+        return self.__request(lambda client: client.transcribe_file(file_path, engine, model_name))
+
+
+    def transcribe_files(self, file_paths, engine, model_name):
+
+        return self.__request(lambda client: client.transcribe_files(file_paths, engine, model_name))
+
+
+    def report(self):
+
+        now = time.monotonic()
+
+        with self.lock:
+            return [endpoint.report(now) for endpoint in self.endpoints]
+
+
+    def __request(self, call):
+
+        tried = set()
+        status, output = False, "no SST endpoint available"
+
+        while len(tried) < len(self.endpoints):
+
+            endpoint = self.__select(tried)
+            tried.add(endpoint)
+
+            started = time.monotonic()
+            status, output = call(endpoint.client)
+            self.__done(endpoint, status, time.monotonic() - started, output)
+
+            if status or self.__client_error(output):
+                break
+
+            print(f"SST endpoint {endpoint.url} failed, trying another one: {output}")
+
+        return status, output
+
+
+    def __available(self):
+
+        now = time.monotonic()
+
+        with self.lock:
+            return [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+
+
+    def __select(self, exclude):
+
+        now = time.monotonic()
+
+        with self.lock:
+
+            candidates = [e for e in self.endpoints if e not in exclude]
+            available = [e for e in candidates if e.available(now)]
+
+            if available:
+                endpoint = min(available, key=lambda e: e.cost(self.balancing))
+            else:
+                # all remaining endpoints are ejected, try the one that comes back first
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+
+            endpoint.outstanding += 1
+
+            return endpoint
+
+
+    def __done(self, endpoint, status, duration_s, output=None):
+
+        with self.lock:
+
+            endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+
+            if status:
+                endpoint.failures = 0
+                endpoint.ejected_until = 0.0
+                if duration_s is not None:
+                    if endpoint.latency_s is None:
+                        endpoint.latency_s = duration_s
+                    else:
+                        endpoint.latency_s = 0.8 * endpoint.latency_s + 0.2 * duration_s
+                return
+
+            if self.__client_error(output):
+                return
+
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_failures:
+                endpoint.ejected_until = time.monotonic() + self.eject_s
+                print(f"SST endpoint {endpoint.url} ejected for {self.eject_s}s")
+
+
+    @staticmethod
+    def __client_error(output):
+
+        return isinstance(output, str) and output.startswith("Return code=4")
@@ -0,0 +1,85 @@
+
+"""
+Local stand-in for the STT service, for development and tests.
+
+It implements the endpoints used by STT_REST_API_Client and answers every
+transcription with a description of the uploaded audio instead of decoding
+it. STT_STUB_DELAY_S simulates the decode time, plus a random share of up to
+STT_STUB_JITTER_S: single requests pay it once per file, batch requests
+once per batch.
+
+    uvicorn stt_stub_server:app --port 5000
+"""
+
+import io
+import os
+import time
+import random
+import wave
+from typing import List
+
+from fastapi import FastAPI, APIRouter, UploadFile, File
+
+app = FastAPI(title="STT stub", docs_url="/api/stt/docs")
+
+router = APIRouter()
+
+delay_s = float(os.getenv("STT_STUB_DELAY_S", "0"))
+jitter_s = float(os.getenv("STT_STUB_JITTER_S", "0"))
+
+loaded_models = set()
+
+
+def decode_delay():
+
+    return delay_s + random.uniform(0, jitter_s)
+
+
+def describe(data):
+
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wf:
+            duration = wf.getnframes() / wf.getframerate()
+    except Exception as e:
+        return {"error": f"invalid wav file: {e}"}
+
+    return {"transcript": f"<{duration:.2f}s of audio>", "duration": duration}
+
+
+@router.get("/health")
+def health():
+
+    return {"status": "ok"}
+
+
+@router.post("/models/load")
+def load_model(engine: str, model_name: str):
+
+    loaded_models.add((engine, model_name))
+
+    return {"engine": engine, "model_name": model_name}
+
+
+@router.get("/models/loaded")
+def get_loaded_models():
+
+    return {"models": [{"engine": engine, "model_name": model_name} for engine, model_name in sorted(loaded_models)]}
+
+
+@router.post("/transcribe/file")
+def transcribe_file(engine: str, model_name: str, file: UploadFile = File(...)):
+
+    time.sleep(decode_delay())
+
+    return describe(file.file.read())
+
+
+@router.post("/transcribe/batch")
+def transcribe_batch(engine: str, model_name: str, files: List[UploadFile] = File(...)):
+
+    time.sleep(decode_delay())
+
+    return {"results": [describe(f.file.read()) for f in files]}
+
+
+app.include_router(router, prefix="/api/stt")
@@ -35,9 +35,12 @@ def get_audio_devices():
 
     devices = sd.query_devices()
 
+    # host APIs are queried once for all devices
+    hostapi_names = get_hostapi_names()
+
     for idx, _ in enumerate(devices):
 
-        dev_info = get_device_info(idx)
+        dev_info = get_device_info(idx, hostapi_names)
         if not dev_info:
             continue
 
@@ -61,13 +64,14 @@ def get_audio_devices():
     return mic_only, speaker_only, input_output
 
 
-def get_device_info(device_index):
+def get_device_info(device_index, hostapi_names=None):
 
     try:
 
         dev = sd.query_devices(device_index)
 
-        hostapi_names = get_hostapi_names()
+        if hostapi_names is None:
+            hostapi_names = get_hostapi_names()
         hostapi_name = hostapi_names.get(dev['hostapi'], f"Unknown ({dev['hostapi']})")
 
         return {
@@ -126,7 +130,7 @@ def print_audio_devices_group(title, group):
             print(f"            Latency (out): low={dev['lat_out_low']:.3f}s  high={dev['lat_out_high']:.3f}s\n")
 
 
-def select_best_microphone(mic_devices, input_output, preferred_hostapis=("Windows WASAPI", "Windows DirectSound")):
+def select_best_microphone(mic_devices, input_output, preferred_hostapis=("Windows WASAPI", "Windows DirectSound"), probe=None):
 
     if not mic_devices and not input_output:
         return None
@@ -175,18 +179,26 @@ def select_best_microphone(mic_devices, input_output, preferred_hostapis=("Windo
 
     sorted_devices_phy = [d for d in sorted_devices if is_physical_mic(d)]
 
-    for dev in sorted_devices_phy:
+    probe = probe or probe_input_device
 
-        try:
-            with sd.InputStream(device=dev["index"], channels=1, samplerate=int(dev["rate"])):
-                return dev["index"]
-        except Exception as e:
-            print(f"Skipping device [{dev['index']}] {dev['name']} — not usable: {e}")
+    for dev in sorted_devices_phy:
+        if probe(dev):
+            return dev["index"]
 
     print("No available microphone devices found.")
     return None
 
 
+def probe_input_device(dev):
+
+    try:
+        with sd.InputStream(device=dev["index"], channels=1, samplerate=int(dev["rate"])):
+            return True
+    except Exception as e:
+        print(f"Skipping device [{dev['index']}] {dev['name']} — not usable: {e}")
+        return False
+
+
 def is_physical_mic(dev):
 
     return dev["in_ch"] > 0 and not any(skip in dev["name"] for skip in SKIP_PATTERNS)
@@ -203,3 +215,23 @@ def resample_audio(audio_frames, input_rate=44100, target_rate=16000):
 
     num_samples = int(len(audio_frames) * target_rate / input_rate)
     return resample(audio_frames, num_samples).astype(np.int16)
+
+
+def convert_pcm(pcm, input_rate, input_channels, target_rate, target_channels):
+    """
+    int16 PCM bytes in another rate and channel count: mixed down to mono,
+    resampled, then copied to every target channel.
+    """
+
+    if (input_rate, input_channels) == (target_rate, target_channels):
+        return bytes(pcm)
+
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if not len(samples):
+        return b""
+
+    samples = samples.reshape(-1, input_channels).mean(axis=1).astype(np.int16)
+    if input_rate != target_rate:
+        samples = resample_audio(samples, input_rate, target_rate)
+
+    return np.repeat(samples, target_channels).tobytes()
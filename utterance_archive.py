@@ -0,0 +1,207 @@
+
+import io
+import os
+import gzip
+import json
+import time
+import wave
+import queue
+import threading
+import numpy as np
+
+import config
+import utility
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+
+class UtteranceArchive():
+    """
+    Background writer that archives utterance audio with its metadata.
+
+    submit() only copies the audio into a bounded queue and never blocks;
+    when the writer falls behind, new utterances are dropped and counted.
+    The preroll, captured in the format of the detection engine, is
+    converted to the recording's format by the writer before it is joined.
+    A writer thread stores each utterance as FLAC (or gzipped WAV when
+    soundfile is not installed) next to a JSON metadata file, and deletes
+    the oldest files once the archive exceeds max_bytes or max_age_s.
+    """
+
+    def __init__(self, directory, max_queue=32, max_bytes=2*1024*1024*1024, max_age_s=7*24*3600, rotate_interval_s=60):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.rotate_interval_s = rotate_interval_s
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sequence = 0
+        self.last_rotate = 0.0
+
+        self.stats_lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "failed": 0, "deleted": 0, "bytes": 0}
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer.start()
+
+
+    def submit(self, audio, sample_rate, channels, metadata, preroll=None):
+        """
+        Queue one utterance. preroll is an optional (pcm, sample_rate,
+        channels) of the audio before it. Returns False when it was dropped.
+        """
+
+        try:
+            self.queue.put_nowait((bytes(audio), sample_rate, channels, dict(metadata, archived_at=time.time()), preroll))
+        except queue.Full:
+            self.__count("dropped")
+            return False
+
+        return True
+
+
+    def report(self):
+
+        with self.stats_lock:
+            return {**self.stats, "queued": self.queue.qsize()}
+
+
+    def __count(self, name, value=1):
+
+        with self.stats_lock:
+            self.stats[name] += value
+
+
+    def __write_loop(self):
+
+        while True:
+
+            audio, sample_rate, channels, metadata, preroll = self.queue.get()
+
+            try:
+                size = self.__write(audio, sample_rate, channels, metadata, preroll)
+            except Exception as e:
+                print(f"❌ Failed to archive utterance: {e}")
+                self.__count("failed")
+                continue
+
+            self.__count("written")
+            self.__count("bytes", size)
+
+            if time.monotonic() - self.last_rotate >= self.rotate_interval_s:
+                self.__rotate()
+                self.last_rotate = time.monotonic()
+
+
+    def __write(self, audio, sample_rate, channels, metadata, preroll=None):
+
+        # preroll_s is measured on the converted audio, so it is what the file actually starts with
+        preroll_pcm = b""
+        if preroll and preroll[0]:
+            preroll_pcm = utility.convert_pcm(*preroll, sample_rate, channels)
+
+        audio = preroll_pcm + audio
+        metadata = {**metadata, "preroll_s": round(len(preroll_pcm) / (sample_rate * channels * 2), 3)}
+
+        self.sequence += 1
+        stem = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sequence:06d}")
+
+        if soundfile is not None:
+            audio_path = f"{stem}.flac"
+            samples = np.frombuffer(audio, dtype=np.int16).reshape(-1, channels)
+            soundfile.write(audio_path, samples, sample_rate, format="FLAC", subtype="PCM_16")
+        else:
+            audio_path = f"{stem}.wav.gz"
+            with open(audio_path, "wb") as f:
+                f.write(gzip.compress(self.__wav_bytes(audio, sample_rate, channels)))
+
+        metadata = {
+            **metadata,
+            "audio": os.path.basename(audio_path),
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "duration_s": round(len(audio) / (sample_rate * channels * 2), 3)
+        }
+
+        with open(f"{stem}.json", "w") as f:
+            json.dump(metadata, f)
+
+        return os.path.getsize(audio_path) + os.path.getsize(f"{stem}.json")
+
+
+    @staticmethod
+    def __wav_bytes(audio, sample_rate, channels):
+
+        buffer = io.BytesIO()
+
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(2)
+            wf.setframerate(sample_rate)
+            wf.writeframes(audio)
+
+        return buffer.getvalue()
+
+
+    def __rotate(self):
+
+        files = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - self.max_age_s
+
+        for mtime, size, path in files:
+
+            if total <= self.max_bytes and mtime >= cutoff:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another worker process
+
+            total -= size
+            self.__count("deleted")
+
+
+shared_archive = None
+shared_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """
+    The archive shared by all pipelines of the process, or None when
+    archive_dir is not configured.
+    """
+
+    global shared_archive
+
+    if not config.archive_dir:
+        return None
+
+    with shared_archive_lock:
+
+        if shared_archive is None:
+            shared_archive = UtteranceArchive(
+                config.archive_dir,
+                max_queue=config.archive_queue_size,
+                max_bytes=config.archive_max_bytes,
+                max_age_s=config.archive_max_age_s)
+
+        return shared_archive